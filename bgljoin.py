@@ -3,36 +3,10 @@
 import sys
 import argparse
 import re
+import zfile
 import zlib
 
 
-def zfile(fileName, splitChar="\n", chunkSize=1*1024*1024):
-	dc = zlib.decompressobj(32+zlib.MAX_WBITS) # autodetect gzip or zlib header
-	with open(fileName,'rb') as filePtr:
-		text = ""
-		loop = True
-		while loop:
-			data = filePtr.read(chunkSize)
-			if data:
-				text += dc.decompress(data)
-				data = None
-			else:
-				text += dc.flush()
-				loop = False
-			if text:
-				lines = text.split(splitChar)
-				i,x = 0,len(lines)-1
-				text = lines[x]
-				while i < x:
-					yield lines[i]
-					i += 1
-				lines = None
-		#while data remains
-		if text:
-			yield text
-#zfile()
-
-
 def bgljoin(segmarkPath, markerPath, chm, joinSegFile, outputFile, missingCode, quiet, gzip):
 	with (sys.stdout if ((not outputFile) or (outputFile == '-')) else open(outputFile,'w')) as out:
 		msg = (sys.stderr if (out == sys.stdout) else sys.stdout)
@@ -105,7 +79,7 @@ def bgljoin(segmarkPath, markerPath, chm, joinSegFile, outputFile, missingCode,
 					msg.write("filtering segment %d in '%s' ...\n" % (seg,joinSegFile[seg]))
 				firstline = True
 				kept = dropped = 0
-				for line in zfile(joinSegFile[seg]):
+				for line in zfile.zopen(joinSegFile[seg]):
 					if (not filler) and (missingCode):
 						filler = (" %s" % missingCode) * (line.count(" ") - 2)
 					if firstline:
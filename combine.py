@@ -2,7 +2,7 @@
 
 import sys
 import os
-import zlib
+import zfile
 
 if len(sys.argv) <= 5:
 	name = os.path.basename(sys.argv[0])
@@ -24,33 +24,6 @@ and the original './chr3_input/chr3.markers' file.
 	exit(2)
 
 
-def zfile(fileName, splitChar="\n", chunkSize=1*1024*1024):
-	dc = zlib.decompressobj(32+zlib.MAX_WBITS) # autodetect gzip or zlib header
-	with open(fileName,'rb') as filePtr:
-		text = ""
-		loop = True
-		while loop:
-			data = filePtr.read(chunkSize)
-			if data:
-				text += dc.decompress(data)
-				data = None
-			else:
-				text += dc.flush()
-				loop = False
-			if text:
-				lines = text.split(splitChar)
-				i,x = 0,len(lines)-1
-				text = lines[x]
-				while i < x:
-					yield lines[i]
-					i += 1
-				lines = None
-		#while data remains
-		if text:
-			yield text
-#zfile()
-
-
 # read arguments
 chm = sys.argv[1]
 partsPath = sys.argv[2]
@@ -92,7 +65,7 @@ for seg in range(1,segX):
 	resultPath = os.path.join(outputPath, 'output_chr%sseg%d.chr%s_RH_mod.bgl.%s.gz' % (chm,seg,chm,outputType))
 	sys.stderr.write("filtering chr%sseg%d %s file '%s' ...\n" % (chm,seg,outputType,resultPath))
 	kept = dropped = 0
-	for line in zfile(resultPath):
+	for line in zfile.zopen(resultPath):
 		if first:
 			if seg == 1:
 				sys.stdout.write(line)
@@ -8,94 +8,7 @@ import string
 import struct
 import sys
 import tempfile
-import zlib
-
-
-class zopen(object):
-	
-	def __init__(self, fileName, splitChar="\n", chunkSize=16*1024):
-		self._filePtr = open(fileName,'rb')
-		self._splitChar = splitChar
-		self._chunkSize = chunkSize
-		self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-		self._text = ""
-		self._lines = list()
-	#__init__()
-	
-	
-	def __del__(self):
-		if self._filePtr:
-			self._filePtr.close()
-	#__del__()
-	
-	
-	def __enter__(self):
-		return self
-	#__enter__()
-	
-	
-	def __exit__(self, excType, excVal, excTrace):
-		pass
-	#__exit__()
-	
-	
-	def __iter__(self):
-		return self
-	#__iter__()
-	
-	
-	def __next__(self):
-		# if lines are still cached from the last read, pop one
-		if len(self._lines) > 0:
-			return self._lines.pop()
-		# if there's data left in the source file, read and decompress another chunk
-		if self._dc:
-			data = self._dc.unused_data
-			if data:
-				self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-			else:
-				data = self._filePtr.read(self._chunkSize)
-			if data:
-				self._text += self._dc.decompress(data)
-				data = None
-			else:
-				self._text += self._dc.flush()
-				self._dc = None
-		# if there's no text left, we're done
-		if not self._text:
-			raise StopIteration
-		# split the text into lines
-		self._lines = self._text.split(self._splitChar)
-		self._text = ""
-		# if there's more than one line, store the last to combine with the next chunk
-		# (but if there's only one line, and more to read, then keep reading until we get a linebreak)
-		if len(self._lines) > 1:
-			self._text = self._lines.pop()
-		elif self._dc:
-			self._text = self._lines.pop()
-			self._chunkSize *= 2
-			return self.__next__()
-		# reverse the remaining lines into a stack and pop one to return
-		self._lines.reverse()
-		return self._lines.pop()
-	#__next__()
-	
-	
-	def next(self):
-		return self.__next__()
-	#next()
-	
-	
-	def seek(self, offset, whence = 0):
-		if offset != 0:
-			raise Exception("zfile.seek() does not support offsets != 0")
-		self._filePtr.seek(0, whence)
-		self._dc.flush()
-		self._text = ""
-		self._lines = list()
-	#seek()
-	
-#zopen
+import zfile
 
 
 if __name__ == "__main__":
@@ -196,7 +109,7 @@ example: %(prog)s -f my.fam -m my.markers -g my.gprobs.gz -d my.drop -p output
 	numMarkers = 0
 	for genoPath in args.gprobs:
 		print "reading genotype file '%s' ..." % genoPath
-		with zopen(genoPath) as genoFile:
+		with zfile.zopen(genoPath) as genoFile:
 			header = genoFile.next()
 			if not header.startswith("marker alleleA alleleB"):
 				print "  ERROR: unexpected file header: %s..." % header[:30]
@@ -2,7 +2,6 @@
 
 import sys
 import os
-import gzip
 import zfile
 
 if len(sys.argv) < 2:
@@ -45,7 +44,7 @@ for g in gList:
 		else:
 			raise Exception
 		if os.path.exists(gProbPath[g]):
-			gProbFile[g] = zfile.zopen(gProbPath[g]) if (ext == '.gz') else open(gProbPath[g],'rU')
+			gProbFile[g] = zfile.zopen(gProbPath[g]) if (ext == '.gz') else zfile.mopen(gProbPath[g])
 			break
 	if g not in gProbFile:
 		exit("ERROR: could not find .gprobs or .gprobs.gz file for group %d" % g)
@@ -59,16 +58,16 @@ for g in gList:
 		else:
 			raise Exception
 		if os.path.exists(gDosePath[g]):
-			gDoseFile[g] = zfile.zopen(gDosePath[g]) if (ext == '.gz') else open(gDosePath[g],'rU')
+			gDoseFile[g] = zfile.zopen(gDosePath[g]) if (ext == '.gz') else zfile.mopen(gDosePath[g])
 			break
 	if g not in gDoseFile:
 		exit("ERROR: could not find .dose or .dose.gz file for group %d" % g)
 	gDoseSkip[g] = 0
 if z:
-	gProbOut = gzip.GzipFile('./results12/chr%d.gprobs%s' % (c,'.gz' if z else ''), 'wb', compresslevel=z)
-	gDoseOut = gzip.GzipFile('./results12/chr%d.dose%s' % (c,'.gz' if z else ''), 'wb', compresslevel=z)
-	gProbDupe = gzip.GzipFile('./results12/dupe_chr%d.gprobs%s' % (c,'.gz' if z else ''), 'wb', compresslevel=z)
-	gDoseDupe = gzip.GzipFile('./results12/dupe_chr%d.dose%s' % (c,'.gz' if z else ''), 'wb', compresslevel=z)
+	gProbOut = zfile.zwriter('./results12/chr%d.gprobs%s' % (c,'.gz' if z else ''), compresslevel=z)
+	gDoseOut = zfile.zwriter('./results12/chr%d.dose%s' % (c,'.gz' if z else ''), compresslevel=z)
+	gProbDupe = zfile.zwriter('./results12/dupe_chr%d.gprobs%s' % (c,'.gz' if z else ''), compresslevel=z)
+	gDoseDupe = zfile.zwriter('./results12/dupe_chr%d.dose%s' % (c,'.gz' if z else ''), compresslevel=z)
 else:
 	gProbOut = open('./results12/chr%d.gprobs%s' % (c,'.gz' if z else ''), 'wb')
 	gDoseOut = open('./results12/chr%d.dose%s' % (c,'.gz' if z else ''), 'wb')
@@ -2,7 +2,6 @@
 
 import sys
 import os
-import gzip
 import zfile
 
 if len(sys.argv) < 2:
@@ -74,31 +73,31 @@ for g in groups:
 	
 	for ext in ('','.gz'):
 		if os.path.exists(gHeadPath[g]+ext):
-			gHeadFile[g] = zfile.zopen(gHeadPath[g]+ext) if ext else open(gHeadPath[g],'rU')
+			gHeadFile[g] = zfile.zopen(gHeadPath[g]+ext) if ext else zfile.mopen(gHeadPath[g])
 			break
 	if not gHeadFile[g]:
 		exit("ERROR: could not find %s with or without .gz extension" % gHeadPath[g])
 	
 	for ext in ('','.gz'):
 		if os.path.exists(gProbPath[g]+ext):
-			gProbFile[g] = zfile.zopen(gProbPath[g]+ext) if ext else open(gProbPath[g],'rU')
+			gProbFile[g] = zfile.zopen(gProbPath[g]+ext) if ext else zfile.mopen(gProbPath[g])
 			break
 	if not gProbFile[g]:
 		exit("ERROR: could not find %s with or without .gz extension" % gProbPath[g])
 	
 	for ext in ('','.gz'):
 		if os.path.exists(gDosePath[g]+ext):
-			gDoseFile[g] = zfile.zopen(gDosePath[g]+ext) if ext else open(gDosePath[g],'rU')
+			gDoseFile[g] = zfile.zopen(gDosePath[g]+ext) if ext else zfile.mopen(gDosePath[g])
 			break
 	if not gDoseFile[g]:
 		exit("ERROR: could not find %s with or without .gz extension" % gDosePath[g])
 print "... OK"
 
 print "opening output files (in ./results/) ..."
-gProbOut = gzip.GzipFile('./results/chr%d.gprobs.gz' % c, 'wb', compresslevel=6)
-gDoseOut = gzip.GzipFile('./results/chr%d.dose.gz' % c, 'wb', compresslevel=6)
-gProbDupe = gzip.GzipFile('./results/dupe_chr%d.gprobs.gz' % c, 'wb', compresslevel=6)
-gDoseDupe = gzip.GzipFile('./results/dupe_chr%d.dose.gz' % c, 'wb', compresslevel=6)
+gProbOut = zfile.zwriter('./results/chr%d.gprobs.gz' % c, compresslevel=6)
+gDoseOut = zfile.zwriter('./results/chr%d.dose.gz' % c, compresslevel=6)
+gProbDupe = zfile.zwriter('./results/dupe_chr%d.gprobs.gz' % c, compresslevel=6)
+gDoseDupe = zfile.zwriter('./results/dupe_chr%d.dose.gz' % c, compresslevel=6)
 print "... OK"
 
 # join headers
@@ -2,7 +2,6 @@
 
 import sys
 import os
-import gzip
 import zfile
 
 if len(sys.argv) < 2:
@@ -43,7 +42,7 @@ for g in gList:
 		else:
 			gProbPath[g] = './eMer_phase1/group%d/results_grp%d/chr%d_grp%d.gprobs%s' % (g,g,c,g,ext)
 		if os.path.exists(gProbPath[g]):
-			gProbFile[g] = zfile.zopen(gProbPath[g]) if (ext == '.gz') else open(gProbPath[g],'rU')
+			gProbFile[g] = zfile.zopen(gProbPath[g]) if (ext == '.gz') else zfile.mopen(gProbPath[g])
 			break
 	if g not in gProbFile:
 		exit("ERROR: could not find .gprobs or .gprobs.gz file for group %d" % g)
@@ -57,16 +56,16 @@ for g in gList:
 		else:
 			gDosePath[g] = './eMer_phase1/group%d/results_grp%d/chr%d_grp%d.dose%s' % (g,g,c,g,ext)
 		if os.path.exists(gDosePath[g]):
-			gDoseFile[g] = zfile.zopen(gDosePath[g]) if (ext == '.gz') else open(gDosePath[g],'rU')
+			gDoseFile[g] = zfile.zopen(gDosePath[g]) if (ext == '.gz') else zfile.mopen(gDosePath[g])
 			break
 	if g not in gDoseFile:
 		exit("ERROR: could not find .dose or .dose.gz file for group %d" % g)
 	gDoseSkip[g] = 0
 if z:
-	gProbOut = gzip.GzipFile('./results/chr%d.gprobs%s' % (c,'.gz' if z else ''), 'wb', compresslevel=z)
-	gDoseOut = gzip.GzipFile('./results/chr%d.dose%s' % (c,'.gz' if z else ''), 'wb', compresslevel=z)
-	gProbDupe = gzip.GzipFile('./results/dupe_chr%d.gprobs%s' % (c,'.gz' if z else ''), 'wb', compresslevel=z)
-	gDoseDupe = gzip.GzipFile('./results/dupe_chr%d.dose%s' % (c,'.gz' if z else ''), 'wb', compresslevel=z)
+	gProbOut = zfile.zwriter('./results/chr%d.gprobs%s' % (c,'.gz' if z else ''), compresslevel=z)
+	gDoseOut = zfile.zwriter('./results/chr%d.dose%s' % (c,'.gz' if z else ''), compresslevel=z)
+	gProbDupe = zfile.zwriter('./results/dupe_chr%d.gprobs%s' % (c,'.gz' if z else ''), compresslevel=z)
+	gDoseDupe = zfile.zwriter('./results/dupe_chr%d.dose%s' % (c,'.gz' if z else ''), compresslevel=z)
 else:
 	gProbOut = open('./results/chr%d.gprobs%s' % (c,'.gz' if z else ''), 'wb')
 	gDoseOut = open('./results/chr%d.dose%s' % (c,'.gz' if z else ''), 'wb')
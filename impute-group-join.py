@@ -2,9 +2,10 @@
 
 import argparse
 import collections
-import gzip
+import functools
 import os
 import sys
+import zfile
 
 
 if __name__ == "__main__":
@@ -38,11 +39,28 @@ example: %(prog)s TODO
 	parser.add_argument('-d', '--dupes', action='store', type=str, metavar='prefix',
 		help="prefix for duplicate sample output .dose.gz and .gprobs.gz files"
 	)
+	parser.add_argument('--cache', action='store', type=str, metavar='directory',
+		help="directory on local scratch space in which to keep decompressed copies of input files for re-use by later passes and runs (default: none)"
+	)
+	parser.add_argument('--cache-size', action='store', type=float, metavar='gigabytes', default=64,
+		help="maximum size of the input cache, beyond which the least recently used copies are removed (default: 64)"
+	)
+	parser.add_argument('--readahead', action='store', type=float, metavar='megabytes', default=0,
+		help="read compressed input files in aligned blocks of this size from a helper thread, for high-latency shared filesystems (default: 0, off)"
+	)
 	parser.add_argument('--version', action='version', version=versDesc)
 	
 	# parse arguments
 	args = parser.parse_args()
 	
+	# route input files through the local cache, if any
+	zopen,mopen = zfile.zopen,zfile.mopen
+	if args.cache:
+		cache = zfile.zcache(args.cache, int(args.cache_size * 1024*1024*1024))
+		zopen,mopen = cache.zopen,cache.mopen
+	if args.readahead:
+		zopen = functools.partial(zopen, readahead=int(args.readahead * 1024*1024))
+	
 	# open input file(s)
 	print "finding input .dose(.gz) and .gprobs(.gz) files ..."
 	doseFile = list()
@@ -50,16 +68,16 @@ example: %(prog)s TODO
 	for prefixList in args.input:
 		for prefix in prefixList:
 			if os.path.exists(prefix+'.dose.gz'):
-				doseFile.append(gzip.open(prefix+'.dose.gz','rb'))
+				doseFile.append(zopen(prefix+'.dose.gz'))
 			elif os.path.exists(prefix+'.dose'):
-				doseFile.append(open(prefix+'.dose','rU'))
+				doseFile.append(mopen(prefix+'.dose'))
 			else:
 				exit("ERROR: %s.dose(.gz) not found" % prefix)
 			
 			if os.path.exists(prefix+'.gprobs.gz'):
-				probFile.append(gzip.open(prefix+'.gprobs.gz','rb'))
+				probFile.append(zopen(prefix+'.gprobs.gz'))
 			elif os.path.exists(prefix+'.gprobs'):
-				probFile.append(open(prefix+'.gprobs','rU'))
+				probFile.append(mopen(prefix+'.gprobs'))
 			else:
 				exit("ERROR: %s.gprobs(.gz) not found" % prefix)
 			
@@ -78,9 +96,9 @@ example: %(prog)s TODO
 		for prefixList in args.sample:
 			for prefix in prefixList:
 				if os.path.exists(prefix+'.bgl.gz'):
-					headerFile.append(gzip.open(prefix+'.bgl.gz','rb'))
+					headerFile.append(zopen(prefix+'.bgl.gz'))
 				elif os.path.exists(prefix+'.bgl'):
-					headerFile.append(open(prefix+'.bgl','rU'))
+					headerFile.append(mopen(prefix+'.bgl'))
 				else:
 					exit("ERROR: %s.bgl(.gz) not found" % prefix)
 				
@@ -148,7 +166,12 @@ example: %(prog)s TODO
 				#foreach line
 				print "  #%d: %d markers (%d matching)" % (i+1,m,mMatch)
 			#if first input
-			doseFile[i].seek(0)
+			if args.cache and not isinstance(doseFile[i], zfile.mopen):
+				# the first pass left a local copy behind, so re-open from there
+				doseFile[i].close()
+				doseFile[i] = zopen(doseFile[i].name)
+			else:
+				doseFile[i].seek(0)
 		#foreach input
 		i = iRange0[-1]
 		
@@ -209,9 +232,9 @@ example: %(prog)s TODO
 	
 	# join headers
 	print "joining headers ..."
-	doseOut = gzip.open(args.output+'.dose.gz', 'wb', compresslevel=6)
+	doseOut = zfile.zwriter(args.output+'.dose.gz', compresslevel=6)
 	doseOut.write("marker alleleA alleleB")
-	probOut = gzip.open(args.output+'.gprobs.gz', 'wb', compresslevel=6)
+	probOut = zfile.zwriter(args.output+'.gprobs.gz', compresslevel=6)
 	probOut.write("marker alleleA alleleB")
 	doseDupe = None
 	probDupe = None
@@ -246,10 +269,10 @@ example: %(prog)s TODO
 				if args.dupes:
 					h = " %s(%d/%d)" % (sample,sampleFirst[sample][0],i)
 					if not doseDupe:
-						doseDupe = gzip.open(args.dupes+'.dose.gz', 'wb', compresslevel=6)
+						doseDupe = zfile.zwriter(args.dupes+'.dose.gz', compresslevel=6)
 						doseDupe.write("marker alleleA alleleB")
 					if not probDupe:
-						probDupe = gzip.open(args.dupes+'.gprobs.gz', 'wb', compresslevel=6)
+						probDupe = zfile.zwriter(args.dupes+'.gprobs.gz', compresslevel=6)
 						probDupe.write("marker alleleA alleleB")
 					doseDupe.write(h)
 					probDupe.write(h*3)
@@ -338,18 +361,21 @@ example: %(prog)s TODO
 			#foreach input
 			
 			# for the first input, store the allele order and then write the data through directly
+			# (each output row is assembled in a list and written with a single call)
 			a1 = doseLine[0][1]
 			a2 = doseLine[0][2]
+			doseRow = list()
+			probRow = list()
 			if doseUniq[0] == True:
-				doseOut.write(" ".join(doseLine[0]))
+				doseRow.append(" ".join(doseLine[0]))
 			elif doseUniq[0] != False:
-				doseOut.write("%s %s %s " % (marker,a1,a2))
-				doseOut.write(" ".join(doseLine[0][c] for c in doseUniq[0]))
+				doseRow.append("%s %s %s " % (marker,a1,a2))
+				doseRow.append(" ".join(doseLine[0][c] for c in doseUniq[0]))
 			if probUniq[0] == True:
-				probOut.write(" ".join(probLine[0]))
+				probRow.append(" ".join(probLine[0]))
 			elif probUniq[0] != False:
-				probOut.write("%s %s %s " % (marker,a1,a2))
-				probOut.write(" ".join(probLine[0][c] for c in probUniq[0]))
+				probRow.append("%s %s %s " % (marker,a1,a2))
+				probRow.append(" ".join(probLine[0][c] for c in probUniq[0]))
 			
 			# for other inputs, compare allele order to input 1
 			for i in iRange1:
@@ -366,34 +392,33 @@ example: %(prog)s TODO
 				elif doseLine[i][1] != a1 or doseLine[i][2] != a2 or probLine[i][1] != a1 or probLine[i][2] != a2:
 					exit("ERROR: input #%d marker '%s' allele mismatch (%s/%s expected, %s/%s in .dose, %s/%s in .gprobs)" % (i+1,marker,a1,a2,doseLine[i][1],doseLine[i][2],probLine[i][1],probLine[i][2]))
 				if doseUniq[i] == True:
-					doseOut.write(" ")
-					doseOut.write(" ".join(doseLine[i][3:]))
+					doseRow.append(" ")
+					doseRow.append(" ".join(doseLine[i][3:]))
 				elif doseUniq[i] != False:
-					doseOut.write(" ")
-					doseOut.write(" ".join(doseLine[i][c] for c in doseUniq[i]))
+					doseRow.append(" ")
+					doseRow.append(" ".join(doseLine[i][c] for c in doseUniq[i]))
 				if probUniq[i] == True:
-					probOut.write(" ")
-					probOut.write(" ".join(probLine[i][3:]))
+					probRow.append(" ")
+					probRow.append(" ".join(probLine[i][3:]))
 				elif probUniq[i] != False:
-					probOut.write(" ")
-					probOut.write(" ".join(probLine[i][c] for c in probUniq[i]))
+					probRow.append(" ")
+					probRow.append(" ".join(probLine[i][c] for c in probUniq[i]))
 			#foreach input
-			doseOut.write("\n")
-			probOut.write("\n")
+			doseRow.append("\n")
+			probRow.append("\n")
+			doseOut.write("".join(doseRow))
+			probOut.write("".join(probRow))
 			
 			# write dupe lines from various inputs, if any
 			if sampleDupes and args.dupes:
-				doseDupe.write("%s %s %s " % (marker,a1,a2))
-				doseDupe.write(" ".join(doseLine[dupe[0]][3+dupe[1]] for dupe in sampleDupes))
-				doseDupe.write("\n%s %s %s " % (marker,a1,a2))
-				doseDupe.write(" ".join(doseLine[dupe[2]][3+dupe[3]] for dupe in sampleDupes))
-				doseDupe.write("\n")
-				
-				probDupe.write("%s %s %s " % (marker,a1,a2))
-				probDupe.write(" ".join(("%s %s %s" % tuple(probLine[dupe[0]][(3+3*dupe[1]):(6+3*dupe[1])])) for dupe in sampleDupes))
-				probDupe.write("\n%s %s %s " % (marker,a1,a2))
-				probDupe.write(" ".join(("%s %s %s" % tuple(probLine[dupe[2]][(3+3*dupe[3]):(6+3*dupe[3])])) for dupe in sampleDupes))
-				probDupe.write("\n")
+				doseDupe.write("%s %s %s %s\n%s %s %s %s\n" % (
+					marker,a1,a2, " ".join(doseLine[dupe[0]][3+dupe[1]] for dupe in sampleDupes),
+					marker,a1,a2, " ".join(doseLine[dupe[2]][3+dupe[3]] for dupe in sampleDupes)
+				))
+				probDupe.write("%s %s %s %s\n%s %s %s %s\n" % (
+					marker,a1,a2, " ".join(("%s %s %s" % tuple(probLine[dupe[0]][(3+3*dupe[1]):(6+3*dupe[1])])) for dupe in sampleDupes),
+					marker,a1,a2, " ".join(("%s %s %s" % tuple(probLine[dupe[2]][(3+3*dupe[3]):(6+3*dupe[3])])) for dupe in sampleDupes)
+				))
 			#if dupes
 			
 			# read forward in all files
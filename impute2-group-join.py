@@ -1,112 +1,848 @@
 #!/usr/bin/env python
 
 import argparse
+import array
+import bisect
 import collections
-import gzip
+import cPickle
+import filecmp
+import functools
 import itertools
+import multiprocessing
 import os
+import Queue
+import subprocess
 import sys
-import zlib
+import time
+import zfile
 
 
-class zopen(object):
+class impute2Row(object):
+	# one line of .impute2 data, tokenized lazily: the five marker columns are split
+	# off up front, but the per-sample probabilities stay one raw string until
+	# something needs them individually (projection, allele swap, dupes)
+	__slots__ = ('head','raw','_probs')
 	
-	def __init__(self, fileName, splitChar="\n", chunkSize=1024*1024):
-		self._filePtr = open(fileName,'rb')
-		self._splitChar = splitChar
-		self._chunkSize = chunkSize
-		self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-		self._text = ""
-		self._lines = list()
+	def __init__(self, line):
+		words = line.split(None, 5)
+		self.head = words[0:5]
+		self.raw = words[5].rstrip() if (len(words) > 5) else ""
+		self._probs = None
 	#__init__()
 	
 	
-	def __del__(self):
-		if self._filePtr:
-			self._filePtr.close()
-			self._filePtr = None
-	#__del__()
+	def __getstate__(self):
+		# only the text needs to cross a process boundary; it can be re-split on the other side
+		return (self.head, self.raw)
+	#__getstate__()
 	
 	
-	def __enter__(self):
-		return self
-	#__enter__()
+	def __setstate__(self, state):
+		self.head,self.raw = state
+		self._probs = None
+	#__setstate__()
 	
 	
-	def __exit__(self, excType, excVal, excTrace):
-		pass
-	#__exit__()
+	def probs(self):
+		if self._probs is None:
+			self._probs = self.raw.split()
+		return self._probs
+	#probs()
 	
 	
-	def __iter__(self):
-		return self
-	#__iter__()
+	def cols(self):
+		# count columns without splitting, as long as the probabilities are single-space separated
+		if (self._probs is None) and ("  " not in self.raw) and ("\t" not in self.raw):
+			return 5 + (self.raw.count(" ") + 1 if self.raw else 0)
+		return 5 + len(self.probs())
+	#cols()
 	
 	
-	def __next__(self):
-		# if lines are still cached from the last read, pop one
-		if len(self._lines) > 0:
-			return self._lines.pop()
-		# if there's data left in the source file, read and decompress another chunk
-		if self._dc:
-			data = self._dc.unused_data
-			if data:
-				self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-			elif not self._filePtr:
-				raise Exception("cannot read a closed file")
-			else:
-				data = self._filePtr.read(self._chunkSize)
-			if data:
-				self._text += self._dc.decompress(data)
-				data = None
-			else:
-				self._text += self._dc.flush()
-				self._dc = None
-		# if there's no text left, we're done
-		if not self._text:
-			raise StopIteration
-		# split the text into lines
-		self._lines = self._text.split(self._splitChar)
-		self._text = ""
-		# if there's more than one line, store the last to combine with the next chunk
-		# (but if there's only one line, and more to read, then keep reading until we get a linebreak)
-		if len(self._lines) > 1:
-			self._text = self._lines.pop()
-		elif self._dc:
-			self._text = self._lines.pop()
-			self._chunkSize *= 2
-			return self.__next__()
-		# reverse the remaining lines into a stack and pop one to return
-		self._lines.reverse()
-		return self._lines.pop()
-	#__next__()
+	def project(self, runs, cols):
+		# copy out runs of kept probability columns as whole slices: when every value
+		# has the same width (the usual case) the run offsets can be computed directly,
+		# otherwise fall back to a full split
+		raw = self.raw
+		if self._probs is None:
+			w = raw.find(" ")
+			if (w > 0) and (len(raw) == cols * (w + 1) - 1) and (raw.count(" ") == cols - 1) and (raw[w::w+1].count(" ") == cols - 1):
+				w += 1
+				return " ".join(raw[(a*w):(b*w-1)] for a,b in runs)
+		probs = self.probs()
+		return " ".join(" ".join(probs[a:b]) for a,b in runs)
+	#project()
+	
+	
+	def swap(self):
+		# exchange the first and third probability of every sample in place, as two
+		# strided slice assignments rather than a per-sample loop
+		probs = self.probs()
+		probs[0::3],probs[2::3] = probs[2::3],probs[0::3]
+	#swap()
+	
+	
+	def sample(self, s):
+		# the three probabilities of sample s (counting from 0) as text
+		return "%s %s %s" % tuple(self.probs()[(3*s):(3+3*s)])
+	#sample()
+	
+	
+	def text(self):
+		# probabilities as single-space separated text, re-joined only if they had to be
+		if (self._probs is None) and ("  " not in self.raw) and ("\t" not in self.raw):
+			return self.raw
+		return " ".join(self.probs())
+	#text()
+	
+	
+#impute2Row
+
+
+def swapText(text):
+	# exchange the first and third of every three values in a line of probabilities
+	probs = text.split()
+	probs[0::3],probs[2::3] = probs[2::3],probs[0::3]
+	return " ".join(probs)
+#swapText()
+
+
+class pastedRow(object):
+	# stands in for an impute2Row in the paste stage of a column-partitioned join: a worker
+	# has already projected the kept probabilities (and any dupe samples) to text, swapped
+	# if the alleles were reversed relative to the marker index, so the swap only has to
+	# be undone here in the rare case that the first input's alleles were reversed too
+	__slots__ = ('head','_text','_cols','_samples','_flipped','_swapped')
+	
+	def __init__(self, head, text, cols, samples, flipped):
+		self.head = head
+		self._text = text
+		self._cols = cols
+		self._samples = samples
+		self._flipped = flipped
+		self._swapped = False
+	#__init__()
+	
+	
+	def cols(self):
+		return self._cols
+	#cols()
+	
+	
+	def swap(self):
+		self._swapped = not self._swapped
+	#swap()
+	
+	
+	def sample(self, s):
+		return swapText(self._samples[s]) if (self._swapped != self._flipped) else self._samples[s]
+	#sample()
+	
+	
+	def text(self):
+		return swapText(self._text) if (self._swapped != self._flipped) else self._text
+	#text()
+	
+	
+	def project(self, runs, cols):
+		# the worker already kept only the unique samples' columns
+		return self.text()
+	#project()
+	
+	
+#pastedRow
+
+
+def infoMean(values):
+	# format the average of one info column across inputs, or -1 if every input was missing it
+	return ("%1.3f" % (sum(values)/len(values))) if values else "-1"
+#infoMean()
+
+
+def mergeInfo(snp, label, pos, infos, swapped, labels=None):
+	# merge one marker's .impute2_info rows (snp_id rs_id position exp_freq_a1 info certainty type
+	# info_type0 concord_type0 r2_type0) column by column, skipping missing ("-1") scores;
+	# exp_freq_a1 is flipped for inputs whose alleles were swapped. This runs once per marker as
+	# it's joined: without NumPy, converting a whole batch of markers' scores at once is slower
+	cols = zip(*(info[0:10] for info in infos))
+	if not ((labels is not None) or any(("," in v) for v in cols[4])):
+		freq = [ ((1.0 - float(v)) if s else float(v)) for v,s in itertools.izip(cols[3],swapped) if v != "-1" ]
+		means = [ infoMean([ float(v) for v in cols[c] if v != "-1" ]) for c in (4,5,7,8,9) ]
+		return "%s %s %s %s %s %s %d %s %s %s\n" % (
+			snp, label, pos, infoMean(freq), means[0], means[1], min(int(v) for v in cols[6]), means[2], means[3], means[4]
+		)
+	
+	# a --tree stage keeps every original input's scores as a comma-separated list (with a "~"
+	# marking a frequency to be flipped) so that the last stage can average them exactly as a
+	# single join of all the inputs would, and adds a column listing all of their labels
+	freq = list()
+	for v,s in itertools.izip(cols[3],swapped):
+		for f in v.split(','):
+			if s and (f != "-1"):
+				f = f[1:] if f.startswith('~') else ('~'+f)
+			freq.append(f)
+	lists = [ list(itertools.chain(*(v.split(',') for v in cols[c]))) for c in (4,5,7,8,9) ]
+	typ = min(int(t) for v in cols[6] for t in v.split(','))
+	if labels is not None:
+		return "%s %s %s %s %s %s %d %s %s %s %s\n" % (
+			snp, label, pos, ",".join(freq), ",".join(lists[0]), ",".join(lists[1]), typ, ",".join(lists[2]), ",".join(lists[3]), ",".join(lists[4]), ",".join(labels)
+		)
+	freq = [ ((1.0 - float(f[1:])) if f.startswith('~') else float(f)) for f in freq if f != "-1" ]
+	means = [ infoMean([ float(v) for v in values if v != "-1" ]) for values in lists ]
+	return "%s %s %s %s %s %s %d %s %s %s\n" % (
+		snp, label, pos, infoMean(freq), means[0], means[1], typ, means[2], means[3], means[4]
+	)
+#mergeInfo()
+
+
+class markerTable(object):
+	# columnar table of markers: positions, interned allele pairs and rs# labels are kept
+	# in arrays, while snp_ids and any other labels are packed end to end in one string pool
+	# (with a run of identical snp_ids such as "---" sharing one copy), so each marker costs a
+	# few dozen bytes plus the length of its text; a (position,alleles) key is found by binary
+	# search as long as positions were added in order, or through a hash table if they weren't
+	
+	def __init__(self):
+		self._pos = array.array('l')
+		self._pair = array.array('i') # code of the lowercase, sorted allele pair used for matching
+		self._alleles = array.array('i') # code of the allele pair as given
+		self._snp = array.array('i') # pool string of the snp_id
+		self._rs = array.array('l') # rs# label, or -1 if none, or -2-k if the label is pool string k
+		self._pool = bytearray()
+		self._poolEnd = array.array('l') # end offset of each pool string
+		self._lastSnp = None
+		self._codes = dict()
+		self._values = list()
+		self._lookup = None
+	#__init__()
+	
+	
+	def __len__(self):
+		return len(self._pos)
+	#__len__()
+	
+	
+	def __getstate__(self):
+		# arrays pickle as lists of ints, so hand them over as raw bytes instead
+		return (self._pos.tostring(), self._pair.tostring(), self._alleles.tostring(), self._snp.tostring(), self._rs.tostring(), str(self._pool), self._poolEnd.tostring(), self._values, (self._lookup is not None))
+	#__getstate__()
+	
+	
+	def __setstate__(self, state):
+		self.__init__()
+		pos,pair,alleles,snp,rs,pool,poolEnd,self._values,unsorted = state
+		self._pos.fromstring(pos)
+		self._pair.fromstring(pair)
+		self._alleles.fromstring(alleles)
+		self._snp.fromstring(snp)
+		self._rs.fromstring(rs)
+		self._pool = bytearray(pool)
+		self._poolEnd.fromstring(poolEnd)
+		self._codes = dict((value,code) for code,value in enumerate(self._values))
+		if unsorted:
+			self._index()
+	#__setstate__()
+	
+	
+	def _store(self, text):
+		self._pool.extend(text)
+		self._poolEnd.append(len(self._pool))
+		return len(self._poolEnd) - 1
+	#_store()
+	
+	
+	def _text(self, k):
+		return str(self._pool[(self._poolEnd[k-1] if k else 0):self._poolEnd[k]])
+	#_text()
+	
+	
+	def _code(self, value):
+		code = self._codes.get(value)
+		if code is None:
+			code = self._codes[value] = len(self._values)
+			self._values.append(value)
+		return code
+	#_code()
+	
+	
+	def _index(self):
+		self._lookup = dict()
+		for n in xrange(len(self._pos)-1, -1, -1):
+			self._lookup[(self._pos[n] << 32) | self._pair[n]] = n
+	#_index()
+	
+	
+	def add(self, pos, pair, alleles, label, snp):
+		n = len(self._pos)
+		code = self._code(pair)
+		if (self._lookup is None) and n and (pos < self._pos[n-1]):
+			self._index()
+		if self._lookup is not None:
+			self._lookup.setdefault((pos << 32) | code, n)
+		self._pos.append(pos)
+		self._pair.append(code)
+		self._alleles.append(self._code(alleles))
+		if (self._lastSnp is None) or (self._lastSnp[0] != snp):
+			self._lastSnp = (snp, self._store(snp))
+		self._snp.append(self._lastSnp[1])
+		self._rs.append(-1)
+		self.setLabel(n, label)
+		return n
+	#add()
+	
+	
+	def findKey(self, pos, pair):
+		# return the index of the first marker with this position and allele pair, or -1
+		code = self._codes.get(pair)
+		if code is None:
+			return -1
+		if self._lookup is not None:
+			return self._lookup.get((pos << 32) | code, -1)
+		positions = self._pos
+		n = bisect.bisect_left(positions, pos)
+		while (n < len(positions)) and (positions[n] == pos):
+			if self._pair[n] == code:
+				return n
+			n += 1
+		return -1
+	#findKey()
+	
+	
+	def find(self, marker):
+		# same as findKey(), for a (position,allele,allele) marker of strings
+		try:
+			return self.findKey(int(marker[0]), marker[1:3])
+		except ValueError:
+			return -1
+	#find()
+	
+	
+	def key(self, n):
+		return (self._pos[n], self._values[self._pair[n]])
+	#key()
+	
+	
+	def marker(self, n):
+		return (str(self._pos[n]),) + self._values[self._pair[n]]
+	#marker()
+	
+	
+	def alleles(self, n):
+		return self._values[self._alleles[n]]
+	#alleles()
+	
+	
+	def snp(self, n):
+		return self._text(self._snp[n])
+	#snp()
+	
+	
+	def label(self, n):
+		rs = self._rs[n]
+		return ('rs%d' % rs) if (rs >= 0) else (None if (rs == -1) else self._text(-2 - rs))
+	#label()
+	
+	
+	def setLabel(self, n, label):
+		if label and label.startswith('rs') and label[2:].isdigit() and (('rs%d' % int(label[2:])) == label):
+			self._rs[n] = int(label[2:])
+		elif label is None:
+			self._rs[n] = -1
+		else:
+			self._rs[n] = -2 - self._store(label)
+	#setLabel()
+	
+	
+	def offerLabel(self, n, label):
+		# keep the preferred of the current and offered labels: the highest rs#, or else the lowest other label
+		if label.startswith('rs') and label[2:].isdigit():
+			rs = int(label[2:])
+			if rs > self._rs[n]:
+				self._rs[n] = rs
+		elif (self._rs[n] == -1) or ((self._rs[n] < -1) and (label < self._text(-2 - self._rs[n]))):
+			self._rs[n] = -2 - self._store(label)
+	#offerLabel()
+	
+	
+	def geno(self, n):
+		# the first five .impute2 columns for this marker
+		a1,a2 = self._values[self._alleles[n]]
+		return [self._text(self._snp[n]), self.label(n), str(self._pos[n]), a1, a2]
+	#geno()
+	
+	
+#markerTable
+
+
+def increasingSubsequence(values):
+	# find a longest strictly increasing subsequence in O(n log n) by patience sorting,
+	# returning a bytearray which flags the members of the subsequence
+	tails = array.array('l') # smallest last value of an increasing run of each length
+	tailAt = array.array('l') # position of that last value
+	prev = array.array('l', [-1]) * len(values)
+	for k,v in enumerate(values):
+		j = bisect.bisect_left(tails, v)
+		if (j < len(tails)) and (tails[j] == v):
+			continue # a repeat can't extend anything its first occurrence didn't
+		if j == len(tails):
+			tails.append(v)
+			tailAt.append(k)
+		else:
+			tails[j] = v
+			tailAt[j] = k
+		if j:
+			prev[k] = tailAt[j-1]
+	keep = bytearray(len(values))
+	k = tailAt[-1] if tailAt else -1
+	while k >= 0:
+		keep[k] = 1
+		k = prev[k]
+	return keep
+#increasingSubsequence()
+
+
+def columnRuns(columns):
+	# compile an ascending list of column indices into (start,stop) runs of adjacent columns
+	runs = list()
+	for c in columns:
+		if runs and (runs[-1][1] == c):
+			runs[-1][1] = c + 1
+		else:
+			runs.append([c,c+1])
+	return list(tuple(run) for run in runs)
+#columnRuns()
+
+
+def scanInput(job):
+	# read one input's .impute2 and .impute2_info files for the marker index building pass;
+	# this runs in a worker process, so any error is returned rather than exit()ed
+	i,genoPath,infoPath,cache,readahead,indexCache = job
+	if indexCache:
+		# inputs scanned by an earlier run are taken from the index cache as long as they're unchanged
+		index = zfile.zindex(indexCache)
+		prints = [ zfile.fingerprint(genoPath), zfile.fingerprint(infoPath) ]
+		rows = index.load([genoPath,infoPath], prints, 'markers')
+		if rows is not None:
+			return (None, rows)
+	zopen,mopen = (cache.zopen,cache.mopen) if cache else (zfile.zopen,zfile.mopen)
+	if readahead:
+		zopen = functools.partial(zopen, readahead=readahead)
+	rows = markerTable()
+	with (zopen(genoPath) if genoPath.endswith('.gz') else mopen(genoPath)) as genoFile:
+		with (zopen(infoPath) if infoPath.endswith('.gz') else mopen(infoPath)) as infoFile:
+			header = infoFile.next().rstrip("\r\n")
+			while header.startswith('#'):
+				header = header[1:]
+			if header != "snp_id rs_id position exp_freq_a1 info certainty type info_type0 concord_type0 r2_type0":
+				return ("ERROR: invalid header on info file #%d: %s" % (i+1,header), None)
+			m = 0
+			while True:
+				# make sure geno/info files agree with eachother
+				try:
+					geno = genoFile.next().rstrip("\r\n").split(None,5)[:-1]
+				except StopIteration:
+					try:
+						line = "#"
+						while line.startswith("#") or (line == header):
+							line = infoFile.next().rstrip("\r\n")
+						return ("ERROR: input genotype file #%d ended after %d markers, but info file continues" % (i+1,m), None)
+					except StopIteration:
+						break
+				try:
+					line = "#"
+					while line.startswith("#") or (line == header):
+						line = infoFile.next().rstrip("\r\n")
+					info = line.split()
+				except StopIteration:
+					return ("ERROR: input info file #%d ended after %d markers, but genotype file continues" % (i+1,m), None)
+				m += 1
+				if (geno[1].lower() != info[1].lower()) or (geno[2].lower() != info[2].lower()):
+					return ("ERROR: marker #%d mismatch in input files #%d: '%s %s' vs '%s %s'" % (m,i+1,geno[1],geno[2],info[1],info[2]), None)
+				try:
+					rows.add(int(geno[2]), (min(geno[3],geno[4]).lower(), max(geno[3],geno[4]).lower()), (geno[3],geno[4]), geno[1], geno[0])
+				except ValueError:
+					return ("ERROR: invalid position for marker #%d in input file #%d: %s" % (m,i+1,geno[2]), None)
+			#while next()
+		#with infoFile
+	#with genoFile
+	if indexCache:
+		index.save([genoPath,infoPath], prints, 'markers', rows)
+	return (None, rows)
+#scanInput()
+
+
+def scanInputs(scanPool, scanJobs, depth):
+	# run scanInput() on the pool and yield the results in input order, with no more than depth
+	# jobs outstanding (one more than the pool has workers, so that they're all kept busy while
+	# the main process checks each result); this way finished marker tables can't pile up here
+	# while an earlier input is still being scanned
+	pending = collections.deque()
+	for job in scanJobs:
+		pending.append(scanPool.apply_async(scanInput, (job,)))
+		if len(pending) >= depth:
+			yield pending.popleft().get()
+	while pending:
+		yield pending.popleft().get()
+#scanInputs()
+
+
+class inputDecoder(object):
+	# reads one input in a separate process during the join: its .impute2 and .impute2_info
+	# lines are checked against eachother, tokenized and looked up in the marker index there,
+	# then handed back in batches through a bounded queue, so the main process only merges
+	
+	def __init__(self, i, genoFile, infoFile, header, markerIndex, zopen, batchSize=4*1024*1024, depth=4):
+		# take over from the open files at their current positions; they're closed here, but the
+		# process isn't started until start(), so that every input's reader threads can be
+		# stopped before any decoder is forked
+		self._position = (genoFile.tell(), genoFile.restartPoint(), infoFile.tell(), infoFile.restartPoint())
+		files = list( ((zfile.mopen if isinstance(f, zfile.mopen) else zopen), f.name) for f in (genoFile,infoFile) )
+		genoFile.close()
+		infoFile.close()
+		self._queue = multiprocessing.Queue(depth)
+		self._rows = collections.deque()
+		self._restarts = None
+		self._leftover = None
+		self._process = multiprocessing.Process(target=self._decode, args=(i, files, header, markerIndex, batchSize))
+		self._process.daemon = True
+	#__init__()
+	
+	
+	def start(self):
+		self._process.start()
+	#start()
+	
+	
+	def _decode(self, i, files, header, markerIndex, batchSize):
+		# decoder process: each batch is a list of (marker,geno,info,index,genoOffset,infoOffset) rows
+		# along with clean restart points for both files from before the batch; the last is followed
+		# by the number of .impute2 lines left over (usually 0), preceded by an error message if
+		# a row could not be decoded
+		genoFile,infoFile = list( opener(name) for opener,name in files )
+		genoFile.seek(self._position[0], 0, self._position[1])
+		infoFile.seek(self._position[2], 0, self._position[3])
+		parent = os.getppid()
+		def put(item, Full=Queue.Full):
+			# give up if the main process has gone away without reading everything
+			while True:
+				try:
+					self._queue.put(item, True, 1.0)
+					return
+				except Full:
+					if os.getppid() != parent:
+						os._exit(1)
+		#put()
+		rows = list()
+		size = 0
+		restarts = (genoFile.restartPoint(), infoFile.restartPoint())
+		for line in genoFile:
+			geno = impute2Row(line)
+			try:
+				line = "#"
+				while line.startswith("#") or (line == header):
+					line = infoFile.next().rstrip("\r\n")
+			except StopIteration:
+				put( (restarts,rows) )
+				put(sum(1 for line in genoFile))
+				return
+			info = line.split()
+			if (geno.head[1].lower() != info[1].lower()) or (geno.head[2].lower() != info[2].lower()):
+				put( (restarts,rows) )
+				put("ERROR: marker #%d mismatch in input files #%d: '%s %s' vs '%s %s'" % (1,i+1,geno.head[1],geno.head[2],info[1],info[2]))
+				put(1 + sum(1 for line in genoFile))
+				return
+			line = geno.head
+			marker = (line[2].lower(), min(line[3],line[4]).lower(), max(line[3],line[4]).lower())
+			rows.append( (marker, geno, info, markerIndex.find(marker), genoFile.tell(), infoFile.tell()) )
+			size += len(geno.raw)
+			if (size >= batchSize) or (len(rows) >= 1024):
+				put( (restarts,rows) )
+				rows = list()
+				size = 0
+				restarts = (genoFile.restartPoint(), infoFile.restartPoint())
+		#foreach line
+		put( (restarts,rows) )
+		put(0)
+	#_decode()
 	
 	
 	def next(self):
-		return self.__next__()
+		# return the next (marker,geno,info,index) row
+		while not self._rows:
+			if self._leftover is not None:
+				raise StopIteration
+			batch = self._queue.get()
+			if isinstance(batch, str):
+				exit(batch)
+			elif isinstance(batch, int):
+				self._leftover = batch
+			else:
+				self._restarts,rows = batch
+				self._rows.extend(rows)
+		row = self._rows.popleft()
+		self._position = (row[4], self._restarts[0], row[5], self._restarts[1])
+		return row[0:4]
 	#next()
 	
 	
-	def seek(self, offset, whence = 0):
-		if not self._filePtr:
-			raise Exception("cannot seek a closed file")
-		if offset != 0:
-			raise Exception("zfile.seek() does not support offsets != 0")
-		self._filePtr.seek(0, whence)
-		self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-		self._text = ""
-		self._lines = list()
-	#seek()
+	def position(self):
+		# (genoOffset, genoRestart, infoOffset, infoRestart) after the last row returned
+		return self._position
+	#position()
+	
+	
+	def remaining(self):
+		# count the .impute2 lines not yet returned
+		n = len(self._rows)
+		self._rows.clear()
+		while self._leftover is None:
+			batch = self._queue.get()
+			if isinstance(batch, str):
+				continue
+			elif isinstance(batch, int):
+				self._leftover = batch
+			else:
+				n += len(batch[1])
+		return n + self._leftover
+	#remaining()
 	
 	
 	def close(self):
-		if self._filePtr:
-			self._filePtr.close()
-			self._filePtr = None
+		if self._process and self._process.pid:
+			if self._process.is_alive():
+				self._process.terminate()
+			self._process.join()
+			self._process = None
 	#close()
 	
 	
-#zopen
+#inputDecoder
+
+
+def partitionColumns(widths, n):
+	# split inputs into up to n contiguous groups of roughly equal total width
+	total = sum(widths)
+	groups = [ list() ]
+	width = 0
+	for i,w in enumerate(widths):
+		if groups[-1] and (len(groups) < n) and ((width * n >= total * len(groups)) or (len(widths) - i <= n - len(groups))):
+			groups.append(list())
+		groups[-1].append(i)
+		width += w
+	return groups
+#partitionColumns()
+
+
+def shardPrefix(prefix, k, n):
+	return "%s.shard%dof%d" % (prefix, k, n)
+#shardPrefix()
+
+
+def concatShards(output, dupes, numShards):
+	# splice the outputs of --shard 1/N through N/N together: only the first shard wrote headers,
+	# so the compressed files can be appended as they are (minus all but the last BGZF EOF block),
+	# while the sample files must be identical and only one copy is kept
+	print "concatenating %d shards ..." % (numShards,)
+	shards = list( shardPrefix(output, k, numShards) for k in xrange(1,numShards+1) )
+	parts = [ (output,shards,'.phased.sample',True,True), (output,shards,'.impute2.gz',False,True), (output,shards,'.impute2_info.gz',False,True), (output,shards,'.log',False,True) ]
+	if dupes:
+		dupeShards = list( shardPrefix(dupes, k, numShards) for k in xrange(1,numShards+1) )
+		parts.extend([ (dupes,dupeShards,'.phased.sample',True,False), (dupes,dupeShards,'.impute2.gz',False,False), (dupes,dupeShards,'.markers',True,False) ])
+	for prefix,prefixes,ext,same,required in parts:
+		fileNames = list( p+ext for p in prefixes )
+		missing = list( fileName for fileName in fileNames if not os.path.exists(fileName) )
+		if len(missing) == len(fileNames) and not required:
+			continue
+		if missing:
+			exit("ERROR: shard output file '%s' not found" % (missing[0],))
+		with open(prefix+ext,'wb') as outFile:
+			if same:
+				for fileName in fileNames[1:]:
+					if not filecmp.cmp(fileNames[0], fileName, shallow=False):
+						exit("ERROR: shard output file '%s' does not match '%s'" % (fileName,fileNames[0]))
+				fileNames = fileNames[0:1]
+			for k,fileName in enumerate(fileNames):
+				with open(fileName,'rb') as inFile:
+					size = os.fstat(inFile.fileno()).st_size
+					if ext.endswith('.gz') and (k < len(fileNames) - 1) and (size >= len(zfile.BGZF_EOF)):
+						inFile.seek(size - len(zfile.BGZF_EOF))
+						if inFile.read() == zfile.BGZF_EOF:
+							size -= len(zfile.BGZF_EOF)
+						inFile.seek(0)
+					while size > 0:
+						data = inFile.read(min(size, 16*1024*1024))
+						if not data:
+							break
+						outFile.write(data)
+						size -= len(data)
+			#foreach shard
+		#with outFile
+		print "  %s" % (prefix+ext,)
+	#foreach part
+	print "... OK"
+#concatShards()
+
+
+def treeJoin(args, prefixList):
+	# join the inputs in a tree of separate runs of this script: groups of --tree inputs are
+	# joined in parallel into intermediate outputs, then groups of those, and so on until one
+	# last run joins the remainder into the real outputs; every run thus holds at most --tree
+	# inputs open, and a marker index covering only those
+	workDir = args.output+'.tree'
+	if not os.path.exists(workDir):
+		os.makedirs(workDir)
+	common = list()
+	if args.filter:
+		common.extend(['-f', args.filter])
+	if args.stream:
+		common.append('-s')
+	if args.region:
+		common.extend(['-r', args.region])
+	if args.pipeline:
+		common.append('--pipeline')
+	if args.cache:
+		common.extend(['--cache', args.cache, '--cache-size', str(args.cache_size)])
+	if args.readahead:
+		common.extend(['--readahead', str(args.readahead)])
+	if args.index_cache:
+		common.extend(['--index-cache', args.index_cache])
+	script = [sys.executable, os.path.abspath(sys.argv[0])]
+	
+	# each run is told which original input each of its inputs is (or -1 for an earlier stage's
+	# output, which lists the original input of each of its samples in <prefix>.origins)
+	level = 0
+	prefixes = prefixList
+	origins = range(len(prefixList))
+	staged = list()
+	while len(prefixes) > args.tree:
+		level += 1
+		groups = list( range(g, min(g+args.tree, len(prefixes))) for g in xrange(0, len(prefixes), args.tree) )
+		parallel = max(1, min(args.processes, sum(1 for group in groups if len(group) > 1)))
+		print "tree level %d: joining %d inputs in %d groups (%d at a time) ..." % (level, len(prefixes), len(groups), parallel)
+		sys.stdout.flush()
+		stages = list()
+		for g,group in enumerate(groups):
+			if len(group) == 1:
+				# a lone input passes straight through to the next level
+				stages.append( (prefixes[group[0]], origins[group[0]], None) )
+				continue
+			stage = os.path.join(workDir, "level%d.group%d" % (level, g+1))
+			cmd = script + ['-i'] + list(prefixes[i] for i in group) + ['-o', stage, '-p', str(max(1, args.processes // parallel)), '--intermediate'] + common
+			cmd.extend(['--origin'] + list(str(origins[i]) for i in group))
+			if args.dupes:
+				cmd.extend(['-d', stage+'.dupes'])
+			if args.markers and (args.markers != '-') and os.path.exists(args.markers):
+				cmd.extend(['-m', args.markers])
+			stages.append( (stage, -1, cmd) )
+			staged.append(stage)
+		running = list()
+		for stage,origin,cmd in stages:
+			if cmd:
+				while len(running) >= parallel:
+					waitStage(*running.pop(0))
+				with open(stage+'.out','wb') as outFile:
+					running.append( (stage, subprocess.Popen(cmd, stdout=outFile, stderr=subprocess.STDOUT)) )
+		while running:
+			waitStage(*running.pop(0))
+		
+		# the previous level's intermediate data is no longer needed (unless it passed straight
+		# through this level), but its logs are kept
+		if level > 1:
+			passed = set( stage for stage,origin,cmd in stages if not cmd )
+			for prefix in prefixes:
+				if prefix.startswith(workDir) and (prefix not in passed):
+					for ext in ('.phased.sample','.impute2.gz','.impute2_info.gz','.origins'):
+						if os.path.exists(prefix+ext):
+							os.remove(prefix+ext)
+		prefixes = list( stage for stage,origin,cmd in stages )
+		origins = list( origin for stage,origin,cmd in stages )
+		print "... OK"
+		sys.stdout.flush()
+	#while too many inputs
+	
+	# join what remains into the real outputs, in the foreground
+	cmd = script + ['-i'] + prefixes + ['-o', args.output, '-p', str(args.processes), '-c', str(args.columns)] + common
+	cmd.extend(['--origin'] + list(str(origin) for origin in origins))
+	if args.dupes:
+		cmd.extend(['-d', args.dupes])
+	if args.markers:
+		cmd.extend(['-m', args.markers])
+	print "tree level %d: joining %d inputs ..." % (level+1, len(prefixes))
+	sys.stdout.flush()
+	ret = subprocess.call(cmd)
+	if ret != 0:
+		exit("ERROR: final join of tree level %d failed" % (level+1,))
+	for prefix in prefixes:
+		if prefix.startswith(workDir):
+			for ext in ('.phased.sample','.impute2.gz','.impute2_info.gz','.origins'):
+				if os.path.exists(prefix+ext):
+					os.remove(prefix+ext)
+	
+	# markers that went unmatched (or were duplicated) within a stage never reached the last one,
+	# so fold those stages' log rows and duplicate markers into the real outputs
+	mergeStageLogs(args.output+'.log', list(stage+'.log' for stage in staged))
+	if args.dupes:
+		mergeStageDupes(args.dupes+'.markers', list(stage+'.dupes.markers' for stage in staged), prefixList)
+	print "intermediate logs kept in '%s'" % (workDir,)
+#treeJoin()
+
+
+def mergeStageLogs(path, stageLogs):
+	# add each stage's "not matched" rows to the final log, once per marker (keeping the row
+	# from the earliest stage that logged it, as that's closest to the original inputs), and
+	# put the whole log back in position order
+	seen = set()
+	rows = list()
+	for logPath in stageLogs + [path]:
+		with open(logPath,'rU') as logFile:
+			header = logFile.readline()
+			for line in logFile:
+				words = line.rstrip("\r\n").split("\t")
+				if (len(words) > 6) and (words[6] == "not matched"):
+					key = tuple(w.lower() for w in words[2:5])
+					if (key in seen):
+						continue
+					seen.add(key)
+				elif logPath != path:
+					continue
+				rows.append( (int(words[2]), line) )
+	#foreach log
+	rows.sort(key=lambda row: row[0])
+	with open(path,'wb') as logFile:
+		logFile.write(header)
+		for pos,line in rows:
+			logFile.write(line)
+#mergeStageLogs()
+
+
+def mergeStageDupes(path, stageDupes, prefixList):
+	# combine each stage's duplicate markers with the last stage's, listing every input that
+	# duplicated each one (in input order)
+	markers = collections.OrderedDict()
+	for dupesPath in stageDupes + [path]:
+		if os.path.exists(dupesPath):
+			with open(dupesPath,'rU') as dupesFile:
+				for line in dupesFile:
+					words = line.split()
+					key = (words[2], min(words[3],words[4]).lower(), max(words[3],words[4]).lower())
+					markers.setdefault(key, (words[0:5], list()))[1].extend(words[5:])
+	#foreach file
+	if markers:
+		print "WARNING: %d markers are duplicated in one or more .impute2(.gz) files" % (len(markers),)
+		print "writing duplicate markers to '%s' ..." % (path,)
+		with open(path,'wb') as dupesFile:
+			for geno,inputs in sorted(markers.itervalues(), key=lambda marker: int(marker[0][2])):
+				dupesFile.write("%s %s\n" % (" ".join(geno), " ".join(sorted(set(inputs), key=(lambda prefix: prefixList.index(prefix) if prefix in prefixList else len(prefixList))))))
+		print "... OK"
+#mergeStageDupes()
+
+
+def waitStage(stage, proc):
+	# wait for one --tree stage to finish, or give up on the whole join if it failed
+	if proc.wait() != 0:
+		exit("ERROR: tree join stage '%s' failed; see '%s.out'" % (stage,stage))
+	print "  %s" % (stage,)
+	sys.stdout.flush()
+#waitStage()
 
 
 if __name__ == "__main__":
@@ -127,12 +863,63 @@ written to separate files using the --dupes prefix, if specified.
 
 The merged .impute2_info file will reflect average scores.
 
-The script requires ~1.5 hours and ~2GB RAM per million markers to be merged,
-but if resource limits are strictly enforced you should add ~500MB-1GB extra.
+The script requires ~1.5 hours per million markers to be merged. The finished
+marker index takes ~30 bytes of RAM per marker plus the length of any snp_ids
+and labels other than rs#s (~50 bytes for chr:pos labels, and each label that
+replaces another adds its own copy). While it is being built, though, each of up
+to --processes+1 inputs being scanned has a marker table of about that size,
+held twice over briefly as it's handed back, so the peak is several times the
+finished index: joining inputs of 400k chr:pos markers each peaked at ~170MB
+with -p 1, ~210MB with -p 4 and ~275MB with -p 8. On top of that, reading ahead
+in each open compressed input buffers up to ~35MB, so if resource limits are
+strictly enforced you should allow that much per input plus ~500MB-1GB extra.
+
+If all inputs are sorted by position, --stream matches markers up in a single
+pass instead of first reading every input to build a marker index, roughly
+halving the run time; markers at the same position are matched by alleles.
+
+To split a long join across cluster jobs, run it N times with --shard 1/N
+through N/N (and otherwise the same options); each job joins an equal share of
+the indexed markers (optionally within a --region) and writes its output using
+the prefix(es) plus ".shard<k>of<N>". Then run once more with --concat N and
+the same --output and --dupes prefixes to splice the shards together without
+recompressing. Build the --markers file beforehand so the shards need not each
+re-scan the inputs to index them.
+
+With --index-cache, the marker index built from each input is kept in the
+given directory and re-used by later runs (until the input's size, mtime or
+sampled content changes), so re-running a join skips the indexing scan.
+
+With --pipeline, each input is read, checked and tokenized by its own process
+during the join while the main process matches and merges the markers, so a
+join of many inputs can keep one core per input busy (the outputs are always
+compressed on all cores).
+
+For very wide joins, --columns N instead splits the inputs into N groups of
+similar width, each joined in its own process over the same marker index; the
+main process then pastes each marker's rows together. This combines with
+--shard, which splits the join the other way.
+
+With --checkpoint, the join periodically records how far it has got (in
+<output>.checkpoint files, removed once it finishes); if it is interrupted, run
+it again with the same options plus --resume to cut the outputs back to the
+last checkpoint and carry on from there.
+
+To join a great many inputs, --tree k joins them k at a time (in parallel, as
+far as --processes allows) into intermediate outputs under <output>.tree, then
+joins those k at a time, and so on, so that no one join holds more than k
+inputs open or indexes more than k inputs' markers. The intermediate outputs
+carry every input's info scores, so the averages come out as they would from a
+single join. Samples duplicated anywhere among the inputs, and every input's
+labels, also reach the final outputs and --dupes files as they would from a
+single join; markers left unmatched or duplicated at any stage are merged into
+the final log and --dupes markers in position order (and since each stage checks
+all of its own inputs, that may include a few markers a single join would not
+have reached). Each stage's own log is also kept.
 """
 	)
-	parser.add_argument('-i', '--input', action='append', nargs='+', type=str, metavar='prefix', required=True,
-		help="prefix(es) of impute2 .phased.sample, .impute2 and .impute2_info files to be joined (required)"
+	parser.add_argument('-i', '--input', action='append', nargs='+', type=str, metavar='prefix',
+		help="prefix(es) of impute2 .phased.sample, .impute2 and .impute2_info files to be joined (required unless --concat)"
 	)
 	parser.add_argument('-f', '--filter', action='store', type=str, metavar='file',
 		help="a file listing the sample IDs to retain while filtering out the rest (default: none)"
@@ -140,20 +927,144 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 	parser.add_argument('-m', '--markers', action='store', type=str, metavar='file',
 		help="a file listing the expected order of all markers across all inputs (default: none)"
 	)
+	parser.add_argument('-s', '--stream', action='store_true',
+		help="match up markers in a single pass over inputs which are each sorted by position, rather than building a marker index first (ignored if --markers names an existing file, or with --region, --shard, --checkpoint or --columns)"
+	)
+	parser.add_argument('-r', '--region', action='store', type=str, metavar='chr:start-end',
+		help="only join indexed markers at positions from start to end, inclusive; inputs are assumed to cover one chromosome, so its name is only for reference (default: all)"
+	)
+	parser.add_argument('--shard', action='store', type=str, metavar='k/N',
+		help="only join the k'th of N equal shares of the indexed markers, writing to the output prefix(es) plus '.shard<k>of<N>' (default: all)"
+	)
+	parser.add_argument('--checkpoint', action='store', type=float, metavar='minutes', default=0,
+		help="save a checkpoint from which the join can be resumed this often (default: 0, never)"
+	)
+	parser.add_argument('--resume', action='store_true',
+		help="resume the join from its last checkpoint, if any, rather than starting over"
+	)
+	parser.add_argument('--concat', action='store', type=int, metavar='N',
+		help="instead of joining inputs, splice together the outputs of --shard 1/N through N/N using the same output prefix(es)"
+	)
+	parser.add_argument('-p', '--processes', action='store', type=int, metavar='number', default=multiprocessing.cpu_count(),
+		help="number of worker processes with which to scan inputs while building the marker index (default: number of CPUs)"
+	)
+	parser.add_argument('-c', '--columns', action='store', type=int, metavar='number', default=1,
+		help="split the inputs into this many groups of roughly equal width, and join each group's sample columns in its own process before pasting the rows together (default: 1)"
+	)
+	parser.add_argument('--pipeline', action='store_true',
+		help="during the join, read and tokenize each input in its own process while the main process merges them (ignored with --columns; default: off)"
+	)
+	parser.add_argument('-t', '--tree', action='store', type=int, metavar='k', default=0,
+		help="join the inputs k at a time in parallel, then join those results k at a time, and so on (default: 0, all at once)"
+	)
+	parser.add_argument('--intermediate', action='store_true',
+		help=argparse.SUPPRESS
+	)
+	parser.add_argument('--origin', action='store', type=int, nargs='+', metavar='number',
+		help=argparse.SUPPRESS
+	)
 	parser.add_argument('-o', '--output', action='store', type=str, metavar='prefix', required=True,
 		help="prefix for joined output and log files"
 	)
 	parser.add_argument('-d', '--dupes', action='store', type=str, metavar='prefix',
 		help="prefix for duplicate sample output files"
 	)
+	parser.add_argument('--cache', action='store', type=str, metavar='directory',
+		help="directory on local scratch space in which to keep decompressed copies of input files for re-use by later passes and runs (default: none)"
+	)
+	parser.add_argument('--cache-size', action='store', type=float, metavar='gigabytes', default=64,
+		help="maximum size of the input cache, beyond which the least recently used copies are removed (default: 64)"
+	)
+	parser.add_argument('--index-cache', action='store', type=str, metavar='directory',
+		help="directory in which to keep each input's marker index, so that later runs over unchanged inputs can skip scanning them (default: none)"
+	)
+	parser.add_argument('--readahead', action='store', type=float, metavar='megabytes', default=0,
+		help="read compressed input files in aligned blocks of this size from a helper thread, for high-latency shared filesystems (default: 0, off)"
+	)
 	parser.add_argument('--version', action='version', version=versDesc)
 	
 	# parse arguments
 	args = parser.parse_args()
 	
+	# splice shard outputs together, if requested
+	if args.concat:
+		if args.concat < 1:
+			exit("ERROR: invalid number of shards: %d" % (args.concat,))
+		concatShards(args.output, args.dupes, args.concat)
+		sys.exit(0)
+	if not args.input:
+		parser.error("argument -i/--input is required")
+	
+	# split a join of many inputs into a tree of smaller joins, if requested
+	if args.tree and (len(list(itertools.chain(*args.input))) > args.tree):
+		if args.tree < 2:
+			exit("ERROR: invalid tree group size: %d" % (args.tree,))
+		if args.shard or args.checkpoint or args.resume:
+			exit("ERROR: --tree cannot be combined with --shard, --checkpoint or --resume")
+		treeJoin(args, list(itertools.chain(*args.input)))
+		sys.exit(0)
+	
+	# parse the region and shard, if any; both need the marker index, so --stream is ignored
+	region = None
+	if args.region:
+		try:
+			start,end = args.region.rpartition(':')[2].replace(',','').split('-')
+			region = (int(start),int(end))
+		except ValueError:
+			exit("ERROR: invalid region: %s" % (args.region,))
+		args.stream = False
+	shard = (1,1)
+	if args.shard:
+		try:
+			shard = tuple(int(k) for k in args.shard.split('/'))
+		except ValueError:
+			shard = ()
+		if (len(shard) != 2) or not (1 <= shard[0] <= shard[1]):
+			exit("ERROR: invalid shard: %s" % (args.shard,))
+		args.output = shardPrefix(args.output, shard[0], shard[1])
+		if args.dupes:
+			args.dupes = shardPrefix(args.dupes, shard[0], shard[1])
+		args.stream = False
+	
+	# route input files through the local cache, if any
+	zopen,mopen = zfile.zopen,zfile.mopen
+	if args.cache:
+		cache = zfile.zcache(args.cache, int(args.cache_size * 1024*1024*1024))
+		zopen,mopen = cache.zopen,cache.mopen
+	if args.readahead:
+		zopen = functools.partial(zopen, readahead=int(args.readahead * 1024*1024))
+	
+	# load the checkpoint to resume from, if any; otherwise clear out any stale one.
+	# checkpoints need the marker index, so --stream is ignored
+	prefixList = list(itertools.chain(*args.input))
+	checkpointPath = args.output+'.checkpoint'
+	checkpointSettings = (prefixList, args.filter, args.dupes, region, shard)
+	resume = None
+	if args.checkpoint or args.resume or (args.columns > 1):
+		args.stream = False
+	if args.resume and os.path.exists(checkpointPath):
+		with open(checkpointPath,'rb') as checkpointFile:
+			resume = cPickle.load(checkpointFile)
+		if resume['settings'] != checkpointSettings:
+			exit("ERROR: checkpoint '%s' was saved by a join of different inputs or options" % (checkpointPath,))
+	else:
+		if args.resume:
+			print "WARNING: no checkpoint found at '%s'; starting from the beginning" % (checkpointPath,)
+		for path in (checkpointPath, checkpointPath+'.index'):
+			if os.path.exists(path):
+				os.remove(path)
+	if args.checkpoint:
+		# record clean restart points in compressed inputs as they're read
+		zopen = functools.partial(zopen, checkpoint=64*1024*1024)
+	
+	# if the marker index will be built, start its scan workers now, before any input reader threads exist to be forked
+	scanPool = None
+	if (args.processes > 1) and (len(prefixList) > 1) and not (args.stream or resume):
+		if not (args.markers and ((args.markers == '-') or os.path.exists(args.markers))):
+			scanPool = multiprocessing.Pool(min(args.processes, len(prefixList)))
+	
 	# open input file(s)
 	print "finding input files ..."
-	prefixList = list(itertools.chain(*args.input))
 	sampleFile = list()
 	genoFile = list()
 	infoFile = list()
@@ -161,29 +1072,29 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 		if os.path.exists(prefix+'.phased.sample.gz'):
 			sampleFile.append(zopen(prefix+'.phased.sample.gz'))
 		elif os.path.exists(prefix+'.phased.sample'):
-			sampleFile.append(open(prefix+'.phased.sample','rU'))
+			sampleFile.append(mopen(prefix+'.phased.sample'))
 		else:
 			exit("ERROR: %s.phased.sample(.gz) not found" % prefix)
 		
 		if os.path.exists(prefix+'.best_guess_haps_imputation.impute2.gz'):
 			genoFile.append(zopen(prefix+'.best_guess_haps_imputation.impute2.gz'))
 		elif os.path.exists(prefix+'.best_guess_haps_imputation.impute2'):
-			genoFile.append(open(prefix+'.best_guess_haps_imputation.impute2','rU'))
+			genoFile.append(mopen(prefix+'.best_guess_haps_imputation.impute2'))
 		elif os.path.exists(prefix+'.impute2.gz'):
 			genoFile.append(zopen(prefix+'.impute2.gz'))
 		elif os.path.exists(prefix+'.impute2'):
-			genoFile.append(open(prefix+'.impute2','rU'))
+			genoFile.append(mopen(prefix+'.impute2'))
 		else:
 			exit("ERROR: %s.best_guess_haps_imputation.impute2(.gz) not found" % prefix)
 		
 		if os.path.exists(prefix+'.best_guess_haps_imputation.impute2_info.gz'):
 			infoFile.append(zopen(prefix+'.best_guess_haps_imputation.impute2_info.gz'))
 		elif os.path.exists(prefix+'.best_guess_haps_imputation.impute2_info'):
-			infoFile.append(open(prefix+'.best_guess_haps_imputation.impute2_info','rU'))
+			infoFile.append(mopen(prefix+'.best_guess_haps_imputation.impute2_info'))
 		elif os.path.exists(prefix+'.impute2_info.gz'):
 			infoFile.append(zopen(prefix+'.impute2_info.gz'))
 		elif os.path.exists(prefix+'.impute2_info'):
-			infoFile.append(open(prefix+'.impute2_info','rU'))
+			infoFile.append(mopen(prefix+'.impute2_info'))
 		else:
 			exit("ERROR: %s.best_guess_haps_imputation.impute2_info(.gz) not found" % prefix)
 		
@@ -194,102 +1105,118 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 	print "... OK: %d sets of input files" % len(sampleFile)
 	
 	# read the marker file, if any
-	markerIndex = collections.OrderedDict()
-	if args.markers and ((args.markers == '-') or os.path.exists(args.markers)):
+	markerIndex = markerTable()
+	streaming = False
+	if resume:
+		print "reading marker index from checkpoint ..."
+		with open(checkpointPath+'.index','rb') as indexFile:
+			markerIndex = cPickle.load(indexFile)
+		print "... OK: %d markers" % (len(markerIndex),)
+	elif args.markers and ((args.markers == '-') or os.path.exists(args.markers)):
 		print "reading markers file ..."
 		with (sys.stdin if (args.markers == '-') else open(args.markers,'rU')) as markerFile:
 			for line in markerFile:
 				if not line.startswith('#'):
 					words = line.rstrip("\r\n").split()
-					marker = (words[2].lower(), min(words[3],words[4]).lower(), max(words[3],words[4]).lower())
-					if marker in markerIndex:
+					try:
+						pos = int(words[2])
+					except ValueError:
+						exit("ERROR: invalid marker position: %s" % (" ".join(words),))
+					pair = (min(words[3],words[4]).lower(), max(words[3],words[4]).lower())
+					if markerIndex.findKey(pos, pair) >= 0:
 						exit("ERROR: duplicate marker: %s" % (" ".join(words),))
-					markerIndex[marker] = (len(markerIndex),words[1])
+					markerIndex.add(pos, pair, (words[3],words[4]), words[1], words[0])
 		#with markerFile
 		print "... OK: %d markers" % (len(markerIndex),)
+	elif args.stream:
+		# markers will be matched up on the fly during the join, but duplicates must still be tracked
+		streaming = True
+		markerOrder = markerTable() # duplicated markers, labelled as the marker index would have them
+		markerDupe = collections.defaultdict(set) # {n:{i}}
 	else:
 		print "building markers index from input files ..."
-		markerList = list()
-		markerOrder = dict()
-		markerExpect = set()
-		markerGeno = dict()
-		markerInfo = dict()
-		markerLabels = collections.defaultdict(set)
-		markerDupe = collections.defaultdict(set)
-		markerSwap = collections.defaultdict( lambda:collections.defaultdict(set) ) # {m1:{m2:{i}}}
+		markerOrder = markerTable() # markers of the first input, in order
+		markerState = array.array('H') # number of inputs in which each marker has been matched in order
+		markerDupe = collections.defaultdict(set) # {n:{i}}
 		
-		for i in iRange0:
-			m = mCur = mPrev = 0
-			header = infoFile[i].next().rstrip("\r\n")
-			while header.startswith('#'):
-				header = header[1:]
-			if header != "snp_id rs_id position exp_freq_a1 info certainty type info_type0 concord_type0 r2_type0":
-				exit("ERROR: invalid header on info file #%d: %s" % (i+1,header))
-			markerExpect = set(markerOrder)
-			while True:
-				# make sure geno/info files agree with eachother
-				try:
-					geno = genoFile[i].next().rstrip("\r\n").split(None,5)[:-1]
-				except StopIteration:
-					try:
-						line = "#"
-						while line.startswith("#") or (line == header):
-							line = infoFile[i].next().rstrip("\r\n")
-						exit("ERROR: input genotype file #%d ended after %d markers, but info file continues" % (i+1,m))
-					except StopIteration:
-						break
-				try:
-					line = "#"
-					while line.startswith("#") or (line == header):
-						line = infoFile[i].next().rstrip("\r\n")
-					info = line.split()
-				except StopIteration:
-					exit("ERROR: input info file #%d ended after %d markers, but genotype file continues" % (i+1,m))
-				m += 1
-				if (geno[1].lower() != info[1].lower()) or (geno[2].lower() != info[2].lower()):
-					exit("ERROR: marker #%d mismatch in input files #%d: '%s %s' vs '%s %s'" % (m,i+1,geno[1],geno[2],info[1],info[2]))
-				marker = (geno[2].lower(), min(geno[3],geno[4]).lower(), max(geno[3],geno[4]).lower())
-				
+		# scan inputs in worker processes (one per worker at a time), and check them against eachother in order
+		scanJobs = list( (i,genoFile[i].source,infoFile[i].source,(cache if args.cache else None),int(args.readahead * 1024*1024),args.index_cache) for i in iRange0 )
+		for i,scan in enumerate(scanInputs(scanPool, scanJobs, min(args.processes, len(prefixList)) + 1) if scanPool else itertools.imap(scanInput, scanJobs)):
+			error,rows = scan
+			if error:
+				if scanPool:
+					scanPool.terminate()
+				exit(error)
+			sequence = array.array('l')
+			sequenceRow = array.array('l')
+			for r in xrange(len(rows)):
+				pos,pair = rows.key(r)
+				n = markerOrder.findKey(pos, pair)
 				if i == 0:
 					# for the first input, just check for duplicates and store metadata
-					if marker in markerOrder:
-						markerDupe[marker].add(i)
+					if n >= 0:
+						markerDupe[n].add(i)
 					else:
-						markerOrder[marker] = len(markerList)
-						markerList.append(marker)
-						markerGeno[marker] = geno
-						markerInfo[marker] = info
-						for lbl in geno[1].lower().split(';'):
-							markerLabels[marker].add(lbl)
-				elif marker in markerExpect:
-					# for subsequent inputs, verify relative order
-					for lbl in geno[1].lower().split(';'):
-						markerLabels[marker].add(lbl)
-					mCur = markerOrder[marker]
-					if mCur >= mPrev:
-						markerExpect.remove(marker)
-						mPrev = mCur
-					while mCur < mPrev:
-						mCur += 1
-						markerSwap[marker][markerList[mCur]].add(i+1) # +1 here so we can .join() later
-				elif marker in markerOrder:
-					markerDupe[marker].add(i)
+						n = markerOrder.add(pos, pair, rows.alleles(r), None, rows.snp(r))
+						markerState.append(1)
+						for lbl in rows.label(r).lower().split(';'):
+							markerOrder.offerLabel(n, lbl)
+				elif (n >= 0) and (markerState[n] == i):
+					# for subsequent inputs, collect the order of the markers they have in common
+					sequence.append(n)
+					sequenceRow.append(r)
 				#if i
-			#while next()
-			genoFile[i].seek(0)
-			infoFile[i].seek(0)
+			#foreach row
+			
+			# keep the largest set of common markers that this input has in the same order as the
+			# first; any repeats of those are duplicates, and the rest are out of order
+			if i > 0:
+				keep = increasingSubsequence(sequence)
+				for k,n in enumerate(sequence):
+					if keep[k]:
+						markerState[n] = i + 1
+				conflicts = list()
+				for k,n in enumerate(sequence):
+					if keep[k] or (markerState[n] == i):
+						for lbl in rows.label(sequenceRow[k]).lower().split(';'):
+							markerOrder.offerLabel(n, lbl)
+					if keep[k]:
+						continue
+					elif markerState[n] > i:
+						markerDupe[n].add(i)
+					elif conflicts and (conflicts[-1][1] == k - 1):
+						conflicts[-1][1] = k
+					else:
+						conflicts.append([k,k])
+				#foreach marker
+				if conflicts:
+					num = sum(k2 - k1 + 1 for k1,k2 in conflicts)
+					print "  WARNING: %d markers in .impute2(.gz) file #%d are out of order relative to file #1 and will be skipped:" % (num,i+1)
+					for k1,k2 in conflicts[0:10]:
+						print "    positions %d-%d (%d markers)" % (markerOrder.key(sequence[k1])[0],markerOrder.key(sequence[k2])[0],k2-k1+1)
+					if len(conflicts) > 10:
+						print "    ... and %d more ranges" % (len(conflicts) - 10,)
+				keep = conflicts = None
+			#if i
+			sequence = sequenceRow = None
+			m = len(rows)
+			rows = scan = None
+			if args.cache and not isinstance(genoFile[i], zfile.mopen):
+				# the scan left a local copy behind, so re-open from there
+				genoFile[i].close()
+				genoFile[i] = zopen(genoFile[i].name)
+			if args.cache and not isinstance(infoFile[i], zfile.mopen):
+				infoFile[i].close()
+				infoFile[i] = zopen(infoFile[i].name)
 			if i == 0:
 				print "  #%d: %d markers" % (i+1,len(markerOrder))
 			else:
-				for marker in markerExpect:
-					del markerOrder[marker]
-				print "  #%d: %d markers (%d matching)" % (i+1,m,len(markerOrder))
+				print "  #%d: %d markers (%d matching)" % (i+1,m,markerState.count(i+1))
 		#foreach input
-		
-		# apply highest RS# labels to all markers
-		for marker,labels in markerLabels.iteritems():
-			rses = set(int(l[2:]) for l in labels if (l.startswith('rs') and l[2:].isdigit()))
-			markerGeno[marker][1] = ('rs%d' % max(rses)) if rses else min(labels)
+		if scanPool:
+			scanPool.close()
+			scanPool.join()
+		numInputs = len(iRange0)
 		
 		# check for marker dupe warnings
 		if markerDupe:
@@ -297,40 +1224,45 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 			if args.dupes:
 				print "writing duplicate markers to '%s' ..." % (args.dupes+'.markers',)
 				with open(args.dupes+'.markers','wb') as dupesFile:
-					for marker in sorted(markerDupe, key=markerOrder.get):
-						dupesFile.write("%s %s\n" % (" ".join(markerGeno[marker]), " ".join(prefixList[i] for i in sorted(markerDupe[marker]))))
+					for n in sorted(markerDupe):
+						dupesFile.write("%s %s\n" % (" ".join(markerOrder.geno(n)), " ".join(prefixList[i] for i in sorted(markerDupe[n]))))
 				print "... OK"
 		
-		# check for marker swap errors
-		iSwaps = None
-		for marker1 in markerSwap:
-			for marker2 in markerSwap[marker1]:
-				if (marker1 in markerOrder) and (marker2 in markerOrder):
-					iSwaps = [str(iSwap) for iSwap in sorted(markerSwap[marker1][marker2])]
-					print "ERROR: marker positions %s and %s order swapped in .impute2(.gz) file(s) #%s" % (marker1[0],marker2[0],",#".join(iSwaps))
-		if iSwaps:
-			exit(1)
-		
 		# compile matched markers
-		mPrev = 0
-		for marker in markerList:
-			if (marker in markerOrder) and (markerOrder[marker] >= mPrev):
-				if marker in markerIndex:
-					exit("ERROR: duplicate marker: %s" % (" ".join(marker),))
-				markerIndex[marker] = (len(markerIndex),markerGeno[marker][1])
-				mPrev = markerOrder[marker]
+		for n in xrange(len(markerOrder)):
+			if markerState[n] == numInputs:
+				pos,pair = markerOrder.key(n)
+				markerIndex.add(pos, pair, markerOrder.alleles(n), markerOrder.label(n), markerOrder.snp(n))
 		print "... OK: %d matched markers" % (len(markerIndex),)
 		
 		# write final marker index to file
 		if args.markers:
 			print "writing markers index file ..."
-			with open(args.markers,'wb') as markerFile:
-				markerFile.write("\n".join( " ".join(markerGeno[marker]) for marker in markerIndex.iterkeys() ))
+			with open(args.markers+'.tmp','wb') as markerFile:
+				markerFile.write("\n".join( " ".join(markerIndex.geno(n)) for n in xrange(len(markerIndex)) ))
 				markerFile.write("\n")
+			os.rename(args.markers+'.tmp', args.markers)
 			print "... OK: %d markers written" % (len(markerIndex),)
-		markerList = markerOrder = markerExpect = markerGeno = markerInfo = markerLabels = markerDupe = markerSwap = None
+		markerOrder = markerState = markerDupe = None
 	#if args.markers
 	
+	# select the indexed markers in the region, if any, and then this shard's share of them
+	if region:
+		selection = array.array('l', (n for n in xrange(len(markerIndex)) if region[0] <= markerIndex.key(n)[0] <= region[1]))
+		print "selected %d markers in region %s" % (len(selection),args.region)
+	else:
+		selection = xrange(len(markerIndex))
+	shardStart = len(selection) * (shard[0] - 1) // shard[1]
+	shardEnd = len(selection) * shard[0] // shard[1]
+	if args.shard:
+		print "selected shard %d of %d: markers %d-%d of %d" % (shard[0],shard[1],shardStart+1,shardEnd,len(selection))
+	
+	# keep the marker index alongside the checkpoints, so a resumed join needn't rebuild it
+	if args.checkpoint and not resume:
+		with open(checkpointPath+'.index.tmp','wb') as indexFile:
+			cPickle.dump(markerIndex, indexFile, 2)
+		os.rename(checkpointPath+'.index.tmp', checkpointPath+'.index')
+	
 	# read the sample filter file, if any
 	sampleFilter = None
 	if args.filter:
@@ -349,24 +1281,34 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 	# initialize buffers
 	sampleOut = open(args.output+'.phased.sample', 'wb')
 	sampleDupe = None
-	genoOut = gzip.open(args.output+'.impute2.gz', 'wb', compresslevel=6)
+	genoOut = zfile.zwriter(args.output+'.impute2.gz', compresslevel=(1 if args.intermediate else 6), offset=(resume['outputs'][0] if resume else None))
 	genoDupe = None
 	genoCols = [ None for i in iRange0 ]
 	genoUniq = [ list() for i in iRange0 ]
+	genoRuns = [ None for i in iRange0 ]
 	genoLine = [ None for i in iRange0 ]
 	genoMarker = [ None for i in iRange0 ]
-	genoSkip = [ 0 for i in iRange0 ]
-	infoOut = gzip.open(args.output+'.impute2_info.gz', 'wb', compresslevel=6)
-	infoOut.write("snp_id rs_id position exp_freq_a1 info certainty type info_type0 concord_type0 r2_type0\n")
+	genoIndex = [ None for i in iRange0 ]
+	genoSkip = (resume['genoSkip'] if resume else [ 0 for i in iRange0 ])
+	infoOut = zfile.zwriter(args.output+'.impute2_info.gz', compresslevel=(1 if args.intermediate else 6), offset=(resume['outputs'][1] if resume else None))
 	infoLine = [ None for i in iRange0 ]
-	logOut = open(args.output+'.log', 'wb')
-	logOut.write("#snp_id\trs_id\tposition\tallele1\tallele2\tstatus\tnote\n")
+	if resume:
+		logOut = open(args.output+'.log', 'r+b')
+		logOut.truncate(resume['outputs'][2])
+		logOut.seek(resume['outputs'][2])
+	else:
+		logOut = open(args.output+'.log', 'wb')
+	if (shardStart == 0) and not resume: # later shards' outputs will be appended to the first's
+		infoOut.write("snp_id rs_id position exp_freq_a1 info certainty type info_type0 concord_type0 r2_type0\n")
+		logOut.write("#snp_id\trs_id\tposition\tallele1\tallele2\tstatus\tnote\n")
 	
 	# check samples
 	print "joining samples ..."
 	sampleHeader1 = sampleHeader2 = None
 	sampleFirst = dict()
 	sampleDupes = list()
+	sampleOrigin = list()
+	originOut = (open(args.output+'.origins', 'wb') if args.intermediate else None)
 	inputDrop = set()
 	for i in iRange0:
 		line = sampleFile[i].next().rstrip("\r\n")
@@ -392,13 +1334,23 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 			samples.append(tuple(line.rstrip("\r\n").split()))
 		sampleFile[i].close()
 		
-		# identify duplicate samples
+		# note which of the tree's original inputs each sample came from, if this is a --tree stage
+		if args.origin and (args.origin[i] < 0):
+			with open(prefixList[i]+'.origins','rU') as originFile:
+				sampleOrigin.append(list(int(line) for line in originFile))
+			if len(sampleOrigin[i]) != len(samples):
+				exit("ERROR: %s.origins does not match the .sample input file #%d" % (prefixList[i],i+1))
+		else:
+			sampleOrigin.append([ (args.origin[i] if args.origin else i) ] * len(samples))
+		
+		# identify duplicate samples; an intermediate --tree stage passes them through, so that
+		# the last stage finds each one just as a single join of all the inputs would have
 		numFilter = numDupe = 0
 		for s,sample in enumerate(samples):
 			sampleID = (sample[0].lower(),sample[1].lower())
 			if sampleFilter and (sampleID not in sampleFilter):
 				numFilter += 1
-			elif sampleID in sampleFirst:
+			elif (sampleID in sampleFirst) and not args.intermediate:
 				numDupe += 1
 				sampleDupes.append(sampleFirst[sampleID]+(i,s))
 				if args.dupes:
@@ -407,12 +1359,15 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 						sampleDupe.write("%s\n" % sampleHeader1)
 						sampleDupe.write("%s\n" % sampleHeader2)
 					if not genoDupe:
-						genoDupe = open(args.dupes+'.impute2.gz', 'wb')
-					sampleDupe.write("(%d/%d)%s\n" % (sampleFirst[sampleID][0],i,(" ".join(sample))))
+						genoDupe = zfile.zwriter(args.dupes+'.impute2.gz', compresslevel=6, offset=(resume['outputs'][3] if resume else None))
+					first = sampleFirst[sampleID]
+					sampleDupe.write("(%d/%d)%s\n" % (sampleOrigin[first[0]][first[1]],sampleOrigin[i][s],(" ".join(sample))))
 			else:
-				sampleFirst[sampleID] = (i,s)
-				genoUniq[i].extend(xrange(5+s*3,5+s*3+3))
+				sampleFirst.setdefault(sampleID, (i,s))
+				genoUniq[i].extend(xrange(s*3,s*3+3))
 				sampleOut.write("%s\n" % (" ".join(sample),))
+				if originOut:
+					originOut.write("%d\n" % (sampleOrigin[i][s],))
 		#foreach samples
 		
 		# store expected column count
@@ -423,20 +1378,383 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 		if numFilter or numDupe:
 			if not genoUniq[i]:
 				genoUniq[i] = False
+			else:
+				genoRuns[i] = columnRuns(genoUniq[i])
 		else:
 			genoUniq[i] = True
 	#foreach input
+	if originOut:
+		originOut.close()
 	print "... OK: %d unique samples, %d duplicates" % (len(sampleFirst),len(sampleDupes))
 	if sampleDupes and not args.dupes:
 		print "WARNING: no duplicate output prefix was specified; duplicate samples will be silently dropped!"
 	
 	# join lines
 	print "joining data ..."
-	nextPctP = 10
-	nextPctM = int(len(markerIndex) * (nextPctP / 100.0))
-	numMatch = 0
-	numSkip = 0
-	markerSkip = set()
+	numMatch = (resume['numMatch'] if resume else 0)
+	numSkip = (resume['numSkip'] if resume else 0)
+	markerSkip = (resume['markerSkip'] if resume else set())
+	markerOut = None
+	streamLeftover = [ 0 for i in iRange0 ]
+	decoders = None
+	columnGroups = columnWorkers = columnQueues = columnPending = columnPositions = columnLeftover = None
+	
+	def readRow(i):
+		# read the next marker from input i, making sure its geno and info lines agree,
+		# and note where it is in the marker index (if any)
+		if decoders:
+			marker,geno,info,genoIndex[i] = decoders[i].next()
+			return (marker, geno, info)
+		geno = impute2Row(genoFile[i].next())
+		line = "#"
+		while line.startswith("#") or (line == header):
+			line = infoFile[i].next().rstrip("\r\n")
+		info = line.split()
+		if (geno.head[1].lower() != info[1].lower()) or (geno.head[2].lower() != info[2].lower()):
+			exit("ERROR: marker #%d mismatch in input files #%d: '%s %s' vs '%s %s'" % (1,i+1,geno.head[1],geno.head[2],info[1],info[2]))
+		line = geno.head
+		marker = (line[2].lower(), min(line[3],line[4]).lower(), max(line[3],line[4]).lower())
+		genoIndex[i] = markerIndex.find(marker)
+		return (marker, geno, info)
+	#readRow()
+	
+	def skipRow(i, marker, head, quiet=False):
+		# log an unmatched marker the first time it's seen, unless it's outside the region;
+		# while quietly reading past earlier shards, only remember that it was seen
+		if region:
+			try:
+				if not (region[0] <= int(marker[0]) <= region[1]):
+					return
+			except ValueError:
+				return
+		if marker not in markerSkip:
+			markerSkip.add(marker)
+			if not quiet:
+				logOut.write("%s\t%s\t%s\t-\tnot matched\n" % (head[0], head[1], "\t".join(marker)))
+		if not quiet:
+			genoSkip[i] += 1
+	#skipRow()
+	
+	def inputPosition(i):
+		# (genoOffset, genoRestart, infoOffset, infoRestart) of input i after the last row read
+		if decoders:
+			return decoders[i].position()
+		if columnWorkers:
+			return columnPositions[i]
+		return (genoFile[i].tell(), genoFile[i].restartPoint(), infoFile[i].tell(), infoFile[i].restartPoint())
+	#inputPosition()
+	
+	def saveCheckpoint(s):
+		# flush the outputs to block boundaries and record their lengths along with each
+		# input's position (and the nearest clean restart point before it) and the join's
+		# counters, so that the join can be resumed at marker s
+		genoOut.flush()
+		infoOut.flush()
+		logOut.flush()
+		if genoDupe:
+			genoDupe.flush()
+		positions = list( inputPosition(i) for i in iRange0 )
+		state = {
+			'settings': checkpointSettings,
+			'marker': s,
+			'geno': list( (p[0],p[1]) for p in positions ),
+			'info': list( (p[2],p[3]) for p in positions ),
+			'outputs': (genoOut.tell(), infoOut.tell(), logOut.tell(), (genoDupe.tell() if genoDupe else None)),
+			'numMatch': numMatch,
+			'numSkip': numSkip,
+			'genoSkip': genoSkip,
+			'markerSkip': markerSkip,
+		}
+		with open(checkpointPath+'.tmp','wb') as checkpointFile:
+			cPickle.dump(state, checkpointFile, 2)
+		os.rename(checkpointPath+'.tmp', checkpointPath)
+	#saveCheckpoint()
+	
+	def indexMatches(inputs, skip, checkpoint, verbose):
+		# read forward to each selected marker in index order in the given inputs, yielding its label
+		# if it was found in all of them (with genoLine/infoLine set), or None if it wasn't; rows read
+		# past go to skip(), and markers before this shard's share are read past quietly, the same way
+		# a single job would have read them. Progress is only printed if verbose, and a checkpoint is
+		# saved every so many minutes if checkpoint is set
+		if verbose and (shardStart > 0):
+			print "  reading past %d markers of earlier shards ..." % (shardStart,)
+		nextPctP = 10
+		nextPctM = shardStart + int((shardEnd - shardStart) * (nextPctP / 100.0))
+		first = (resume['marker'] if resume else 0)
+		while first > nextPctM + 1:
+			nextPctP += 10
+			nextPctM = shardStart + int((shardEnd - shardStart) * (nextPctP / 100.0))
+		nextCheckpoint = time.time() + checkpoint * 60
+		for s in xrange(first, shardEnd):
+			index = selection[s]
+			quiet = (s < shardStart)
+			if s > nextPctM:
+				if verbose:
+					print "  ... %d%% ..." % nextPctP
+				nextPctP += 10
+				nextPctM = shardStart + int((shardEnd - shardStart) * (nextPctP / 100.0))
+			if checkpoint and (not quiet) and (time.time() >= nextCheckpoint):
+				saveCheckpoint(s)
+				nextCheckpoint = time.time() + checkpoint * 60
+			
+			# try to read forward to this marker in all inputs
+			for i in inputs:
+				genoMarker[i] = None
+			match = True
+			for i in inputs:
+				n = -1
+				while n < index:
+					if genoMarker[i]:
+						skip(i, genoMarker[i], genoLine[i].head, quiet)
+					genoMarker[i],genoLine[i],infoLine[i] = readRow(i)
+					n = genoIndex[i]
+				match = match and (n == index)
+			#foreach input
+			if not quiet:
+				yield (markerIndex.label(index) if match else None)
+		#foreach marker
+	#indexMatches()
+	
+	def streamMatches():
+		# merge-join inputs which are each sorted by position, one position at a time: gather
+		# every input's (few) markers at the lowest position among them, and match those up by
+		# allele pair in the order of the first input; a marker repeated within one input is a
+		# duplicate there (as long as every input before it has the marker, as when the index
+		# is built), and the rest are skipped in the order an index-driven join would skip them
+		rows = [ None for i in iRange0 ]
+		position = [ None for i in iRange0 ]
+		def advance(i):
+			try:
+				rows[i] = readRow(i)
+			except StopIteration:
+				rows[i] = position[i] = None
+				return False
+			try:
+				pos = int(rows[i][1].head[2])
+			except ValueError:
+				exit("ERROR: invalid position for .impute2(.gz) #%d marker '%s': %s" % (i+1,rows[i][1].head[1],rows[i][1].head[2]))
+			if (position[i] is not None) and (pos < position[i]):
+				exit("ERROR: .impute2(.gz) #%d is not sorted by position at marker '%s' (%d after %d)" % (i+1,rows[i][1].head[1],pos,position[i]))
+			position[i] = pos
+			return True
+		#advance()
+		
+		nextM = 1000000
+		for i in iRange0:
+			advance(i)
+		while any((p is not None) for p in position):
+			ended = (None in position)
+			target = min(p for p in position if p is not None)
+			window = list()
+			first = list()
+			dupes = list()
+			for i in iRange0:
+				group = list()
+				ties = dict() # {marker:k} of each marker's first row in the group
+				repeats = set()
+				while position[i] == target:
+					if rows[i][0] in ties:
+						repeats.add(rows[i][0])
+					else:
+						ties[rows[i][0]] = len(group)
+					group.append(rows[i])
+					advance(i)
+				window.append(group)
+				first.append(ties)
+				dupes.append(repeats)
+			#foreach input
+			
+			# note duplicates, and keep the first row of each marker that every input has
+			matched = list()
+			for k,row in enumerate(window[0]):
+				marker = row[0]
+				if first[0][marker] != k:
+					continue
+				n = -1
+				for i in iRange0:
+					if marker not in first[i]:
+						break
+					if marker in dupes[i]:
+						if n < 0:
+							n = markerOrder.add(target, marker[1:3], tuple(row[1].head[3:5]), None, row[1].head[0])
+						markerDupe[n].add(i)
+				else:
+					if not ended:
+						matched.append(marker)
+				if n >= 0:
+					for i in iRange0:
+						if marker not in first[i]:
+							break
+						for lbl in window[i][first[i][marker]][1].head[1].lower().split(';'):
+							markerOrder.offerLabel(n, lbl)
+			#foreach marker
+			
+			kept = list( set(first[i][marker] for marker in matched) for i in iRange0 )
+			skipped = [ 0 for i in iRange0 ]
+			for marker in matched:
+				labels = set()
+				for i in iRange0:
+					k = first[i][marker]
+					while skipped[i] < k:
+						if skipped[i] not in kept[i]:
+							row = window[i][skipped[i]]
+							skipRow(i, row[0], row[1].head)
+						skipped[i] += 1
+					skipped[i] = max(skipped[i], k + 1)
+					genoMarker[i],genoLine[i],infoLine[i] = window[i][k]
+					labels.update(genoLine[i].head[1].lower().split(';'))
+				rses = set(int(l[2:]) for l in labels if (l.startswith('rs') and l[2:].isdigit()))
+				label = ('rs%d' % max(rses)) if rses else min(labels)
+				if markerOut:
+					markerOut.write("%s %s %s %s %s\n" % (genoLine[0].head[0],label,genoLine[0].head[2],genoLine[0].head[3],genoLine[0].head[4]))
+				yield label
+				nextM -= 1
+				if not nextM:
+					print "  ... %d markers ..." % (numMatch,)
+					nextM = 1000000
+			#foreach marker
+			for i in iRange0:
+				if ended:
+					# nothing can be matched once any input has ended, so the rest are left over
+					# (but still read, in case they hold duplicates)
+					streamLeftover[i] += len(window[i])
+					continue
+				for k in xrange(skipped[i], len(window[i])):
+					if k not in kept[i]:
+						skipRow(i, window[i][k][0], window[i][k][1].head)
+			
+			# nothing at or before this position can turn up again
+			markerSkip.clear()
+		#while inputs remain
+	#streamMatches()
+	
+	def joinColumns(w):
+		# column worker process: take the same walk through the marker index as indexMatches(),
+		# but over only this group's inputs, and send back each marker's skipped rows and (if it
+		# matched) the group's heads, info and kept probabilities, swapped if their alleles are
+		# reversed relative to the index; the last record has the inputs' leftover line counts
+		group = columnGroups[w]
+		for i in group:
+			genoFile[i] = (zfile.mopen if isinstance(genoFile[i], zfile.mopen) else zopen)(genoFile[i].name)
+			genoFile[i].seek(columnPositions[i][0], 0, columnPositions[i][1])
+			infoFile[i] = (zfile.mopen if isinstance(infoFile[i], zfile.mopen) else zopen)(infoFile[i].name)
+			infoFile[i].seek(columnPositions[i][2], 0, columnPositions[i][3])
+		skips = list()
+		def recordSkip(i, marker, head, quiet=False):
+			skips.append( (i, marker, head[0:2], quiet) )
+		#recordSkip()
+		samples = collections.defaultdict(set)
+		for dupe in sampleDupes:
+			samples[dupe[0]].add(dupe[1])
+			samples[dupe[2]].add(dupe[3])
+		parent = os.getppid()
+		def put(item, Full=Queue.Full):
+			# give up if the main process has gone away without reading everything
+			while True:
+				try:
+					columnQueues[w].put(item, True, 1.0)
+					return
+				except Full:
+					if os.getppid() != parent:
+						os._exit(1)
+		#put()
+		
+		batch = list()
+		size = 0
+		for label in indexMatches(group, recordSkip, 0, False):
+			rows = None
+			if label:
+				a1,a2 = markerIndex.alleles(genoIndex[group[0]])
+				rows = list()
+				for i in group:
+					geno = genoLine[i]
+					flipped = (geno.head[3] == a2) and (geno.head[4] == a1)
+					cols = geno.cols()
+					text = ""
+					dupes = dict()
+					if cols == genoCols[i]:
+						if flipped:
+							geno.swap()
+						if genoUniq[i] == True:
+							text = geno.text()
+						elif genoUniq[i] != False:
+							text = geno.project(genoRuns[i], genoCols[i] - 5)
+						dupes = dict( (s,geno.sample(s)) for s in samples[i] )
+					rows.append( (geno.head, text, cols, dupes, flipped, infoLine[i]) )
+					size += len(text)
+			positions = (list( (genoFile[i].tell(), genoFile[i].restartPoint(), infoFile[i].tell(), infoFile[i].restartPoint()) for i in group ) if args.checkpoint else None)
+			batch.append( (list(skips), label, rows, positions) )
+			del skips[:]
+			if (size >= 4*1024*1024) or (len(batch) >= 1024):
+				put(batch)
+				batch = list()
+				size = 0
+		#foreach marker
+		leftover = list( 0 for i in group )
+		if (shardEnd == len(selection)) and not region:
+			leftover = list( sum(1 for line in genoFile[i]) for i in group )
+		batch.append( (list(skips), leftover) )
+		put(batch)
+	#joinColumns()
+	
+	def columnRecord(w):
+		# next record from worker w
+		while not columnPending[w]:
+			try:
+				columnPending[w].extend(columnQueues[w].get(True, 1.0))
+			except Queue.Empty:
+				if not columnWorkers[w].is_alive():
+					exit("ERROR: join worker for .impute2(.gz) file(s) #%d-#%d failed" % (columnGroups[w][0]+1,columnGroups[w][-1]+1))
+		return columnPending[w].popleft()
+	#columnRecord()
+	
+	def columnMatches():
+		# paste stage of a column-partitioned join: take each marker's rows from every group's
+		# worker in input order, just as indexMatches() would have read them from each input,
+		# yielding its label if it was found in all of them (with genoLine/infoLine set)
+		if shardStart > 0:
+			print "  reading past %d markers of earlier shards ..." % (shardStart,)
+		nextPctP = 10
+		nextPctM = shardStart + int((shardEnd - shardStart) * (nextPctP / 100.0))
+		first = max((resume['marker'] if resume else 0), shardStart)
+		nextCheckpoint = time.time() + args.checkpoint * 60
+		for s in xrange(first, shardEnd):
+			if s > nextPctM:
+				print "  ... %d%% ..." % nextPctP
+				nextPctP += 10
+				nextPctM = shardStart + int((shardEnd - shardStart) * (nextPctP / 100.0))
+			if args.checkpoint and (s > first) and (time.time() >= nextCheckpoint):
+				# (not before the first marker, whose record also brings any earlier shards' skips)
+				saveCheckpoint(s)
+				nextCheckpoint = time.time() + args.checkpoint * 60
+			
+			match = True
+			for w,group in enumerate(columnGroups):
+				record = columnRecord(w)
+				for i,marker,head,quiet in record[0]:
+					skipRow(i, marker, head, quiet)
+				if len(record) == 2:
+					# this group ran out of input
+					return
+				skips,label,rows,positions = record
+				if positions:
+					for k,i in enumerate(group):
+						columnPositions[i] = positions[k]
+				if not label:
+					match = False
+					continue
+				for k,i in enumerate(group):
+					head,text,cols,dupes,flipped,infoLine[i] = rows[k]
+					genoLine[i] = pastedRow(head, text, cols, dupes, flipped)
+			#foreach group
+			yield (markerIndex.label(selection[s]) if match else None)
+		#foreach marker
+		for w,group in enumerate(columnGroups):
+			record = columnRecord(w)
+			for k,i in enumerate(group):
+				columnLeftover[i] = record[1][k]
+	#columnMatches()
+	
 	try:
 		# validate info headers
 		for i in iRange0:
@@ -446,115 +1764,107 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 			if header != "snp_id rs_id position exp_freq_a1 info certainty type info_type0 concord_type0 r2_type0":
 				exit("ERROR: invalid header on info file #%d: %s" % (i+1,header))
 		
-		# join each marker in index order
-		m = 0
-		for marker,indexlabel in markerIndex.iteritems():
-			index,label = indexlabel
-			if m > nextPctM:
-				print "  ... %d%% ..." % nextPctP
-				nextPctP += 10
-				nextPctM = int(len(markerIndex) * (nextPctP / 100.0))
-			m += 1
-			
-			# try to read forward to this marker in all inputs
+		# pick up where the checkpoint left off, if resuming
+		if resume:
+			print "  resuming from checkpoint at marker %d ..." % (resume['marker'] - shardStart + 1,)
 			for i in iRange0:
-				genoMarker[i] = None
-			match = True
+				genoFile[i].seek(resume['geno'][i][0], 0, resume['geno'][i][1])
+				infoFile[i].seek(resume['info'][i][0], 0, resume['info'][i][1])
+		
+		# hand the inputs over to column workers or decoder processes, if any
+		# (all of them are closed in this process before any is forked)
+		if (args.columns > 1) and (len(iRange0) > 1):
+			columnGroups = partitionColumns(genoCols, args.columns)
+			print "  joining columns of inputs %s in %d processes ..." % (" ".join(("#%d-#%d" % (group[0]+1,group[-1]+1)) for group in columnGroups),len(columnGroups))
+			columnPositions = list( inputPosition(i) for i in iRange0 )
 			for i in iRange0:
-				while markerIndex.get(genoMarker[i],(-1,None))[0] < index:
-					if genoMarker[i]:
-						if genoMarker[i] not in markerSkip:
-							markerSkip.add(genoMarker[i])
-							logOut.write("%s\t%s\t%s\t-\tnot matched\n" % (genoLine[i][0], genoLine[i][1], "\t".join(genoMarker[i])))
-						genoSkip[i] += 1
-					genoLine[i] = line = genoFile[i].next().rstrip("\r\n").split()
-					genoMarker[i] = (line[2].lower(), min(line[3],line[4]).lower(), max(line[3],line[4]).lower())
-					line = "#"
-					while line.startswith("#") or (line == header):
-						line = infoFile[i].next().rstrip("\r\n")
-					infoLine[i] = line.split()
-					if (genoLine[i][1].lower() != infoLine[i][1].lower()) or (genoLine[i][2].lower() != infoLine[i][2].lower()):
-						exit("ERROR: marker #%d mismatch in input files #%d: '%s %s' vs '%s %s'" % (1,i+1,genoLine[i][1],genoLine[i][2],infoLine[i][1],infoLine[i][2]))
-				match = match and (genoMarker[i] == marker)
-			#foreach input
-			
+				genoFile[i].close()
+				infoFile[i].close()
+			columnQueues = list( multiprocessing.Queue(4) for group in columnGroups )
+			columnPending = list( collections.deque() for group in columnGroups )
+			columnLeftover = dict()
+			columnWorkers = list( multiprocessing.Process(target=joinColumns, args=(w,)) for w in xrange(len(columnGroups)) )
+			for worker in columnWorkers:
+				worker.daemon = True
+				worker.start()
+		elif args.pipeline:
+			decoders = list( inputDecoder(i, genoFile[i], infoFile[i], header, markerIndex, zopen) for i in iRange0 )
+			for decoder in decoders:
+				decoder.start()
+		
+		# join each marker in index order, or as matched up in a single pass over sorted inputs
+		if streaming and args.markers:
+			markerOut = open(args.markers,'wb')
+		for label in (streamMatches() if streaming else (columnMatches() if columnWorkers else indexMatches(iRange0, skipRow, args.checkpoint, True))):
 			# if the expected marker wasn't found in all inputs, move on to the next
-			if not match:
+			if not label:
 				numSkip += 1
 				continue
 			numMatch += 1
 			
 			# extract marker details, but use the preferred label
-			snp = genoLine[0][0]
-			pos = genoLine[0][2]
-			a1 = genoLine[0][3]
-			a2 = genoLine[0][4]
-			aliases = set(genoLine[i][1].lower() for i in iRange0 if genoLine[i][1].lower() != label.lower())
+			snp = genoLine[0].head[0]
+			pos = genoLine[0].head[2]
+			a1 = genoLine[0].head[3]
+			a2 = genoLine[0].head[4]
+			# (a --tree stage's output carries every original input's label in an extra info column)
+			labels = list(itertools.chain(*(
+				(infoLine[i][10].split(',') if len(infoLine[i]) > 10 else (genoLine[i].head[1].lower(),)) for i in iRange0
+			)))
+			aliases = set(lbl for lbl in labels if lbl != label.lower())
 			if aliases:
 				logOut.write("%s\t%s\t%s\t%s\t%s\t+\t%s\n" % (snp,label,pos,a1,a2,";".join(sorted(aliases))))
-			genoLine[0][1] = label
+			genoLine[0].head[1] = label
 			
 			# validate column counts
 			for i in iRange0:
-				if len(genoLine[i]) != genoCols[i]:
-					exit("ERROR: expected %d columns in input .impute2.gz file #%d, but found %d for marker '%s'" % (genoCols[i],i+1,len(genoLine[i]),label))
+				if genoLine[i].cols() != genoCols[i]:
+					exit("ERROR: expected %d columns in input .impute2.gz file #%d, but found %d for marker '%s'" % (genoCols[i],i+1,genoLine[i].cols(),label))
 			#foreach input
 			
 			# for the first input, store the allele order and then write the data through directly
-			values = list()
+			# (each output row is assembled in a list and written with a single call)
+			swapped = [ False for i in iRange0 ]
+			genoRow = list()
 			if genoUniq[0] == True:
-				genoOut.write(" ".join(genoLine[0]))
+				genoRow.append("%s %s %s %s %s " % (snp,label,pos,a1,a2))
+				genoRow.append(genoLine[0].text())
 			elif genoUniq[0] != False:
-				genoOut.write("%s %s %s %s %s " % (snp,label,pos,a1,a2))
-				genoOut.write(" ".join(genoLine[0][c] for c in genoUniq[0]))
+				genoRow.append("%s %s %s %s %s " % (snp,label,pos,a1,a2))
+				genoRow.append(genoLine[0].project(genoRuns[0], genoCols[0] - 5))
 			else:
-				genoOut.write("%s %s %s %s %s" % (snp,label,pos,a1,a2))
-			if infoLine[0][3] != "-1":
-				values.append(float(infoLine[0][3]))
+				genoRow.append("%s %s %s %s %s" % (snp,label,pos,a1,a2))
 			
 			# for other inputs, compare allele order to input 1
 			for i in iRange1:
-				if genoLine[i][3] == a2 and genoLine[i][4] == a1:
+				if genoLine[i].head[3] == a2 and genoLine[i].head[4] == a1:
 					# swap all the probabilities
-					genoLine[i][3] = a1
-					genoLine[i][4] = a2
-					for c in xrange(5,len(genoLine[i]),3):
-						genoLine[i][c],genoLine[i][c+2] = genoLine[i][c+2],genoLine[i][c]
-					if infoLine[i][3] != "-1":
-						values.append(1.0 - float(infoLine[i][3]))
+					genoLine[i].head[3] = a1
+					genoLine[i].head[4] = a2
+					genoLine[i].swap()
+					swapped[i] = True
 					print "  WARNING: swapped allele order for .impute2(.gz) #%d marker '%s'" % (i+1,label)
-				elif genoLine[i][3] != a1 or genoLine[i][4] != a2:
-					exit("ERROR: .impute2(.gz) #%d marker '%s' allele mismatch (%s/%s expected, %s/%s found)" % (i+1,label,a1,a2,genoLine[i][3],genoLine[i][4]))
-				elif infoLine[i][3] != "-1":
-					values.append(float(infoLine[i][3]))
+				elif genoLine[i].head[3] != a1 or genoLine[i].head[4] != a2:
+					exit("ERROR: .impute2(.gz) #%d marker '%s' allele mismatch (%s/%s expected, %s/%s found)" % (i+1,label,a1,a2,genoLine[i].head[3],genoLine[i].head[4]))
 				if genoUniq[i] == True:
-					genoOut.write(" ")
-					genoOut.write(" ".join(genoLine[i][5:]))
+					genoRow.append(" ")
+					genoRow.append(genoLine[i].text())
 				elif genoUniq[i] != False:
-					genoOut.write(" ")
-					genoOut.write(" ".join(genoLine[i][c] for c in genoUniq[i]))
+					genoRow.append(" ")
+					genoRow.append(genoLine[i].project(genoRuns[i], genoCols[i] - 5))
 			#foreach input
-			genoOut.write("\n")
+			genoRow.append("\n")
+			genoOut.write("".join(genoRow))
 			
-			# merge info data (snp_id rs_id position exp_freq_a1 info certainty type info_type0 concord_type0 r2_type0)
-			infoOut.write("%s %s %s %s" % (snp,label,pos,("%1.3f" % (sum(values)/len(values))) if values else "-1"))
-			for c in (4,5):
-				values = list(float(infoLine[i][c]) for i in iRange0 if infoLine[i][c] != "-1")
-				infoOut.write(" %s" % (("%1.3f" % (sum(values)/len(values))) if values else "-1",))
-			values = list(int(infoLine[i][6]) for i in iRange0)
-			infoOut.write(" %d" % (min(values),))
-			for c in (7,8,9):
-				values = list(float(infoLine[i][c]) for i in iRange0 if infoLine[i][c] != "-1")
-				infoOut.write(" %s" % (("%1.3f" % (sum(values)/len(values))) if values else "-1",))
-			infoOut.write("\n")
+			# merge info data
+			infoOut.write(mergeInfo(snp, label, pos, infoLine, swapped, (labels if args.intermediate else None)))
 			
 			# write dupe lines from various inputs, if any
 			if sampleDupes and args.dupes:
-				genoDupe.write("%s %s %s %s %s " % (snp,label,pos,a1,a2))
-				genoDupe.write(" ".join(("%s %s %s" % tuple(genoLine[dupe[0]][(5+3*dupe[1]):(8+3*dupe[1])])) for dupe in sampleDupes))
-				genoDupe.write("\n%s %s %s %s %s " % (snp,label,pos,a1,a2))
-				genoDupe.write(" ".join(("%s %s %s" % tuple(genoLine[dupe[2]][(5+3*dupe[3]):(8+3*dupe[3])])) for dupe in sampleDupes))
-				genoDupe.write("\n")
+				genoDupe.write("%s %s %s %s %s %s\n%s %s %s %s %s %s\n" % (
+					snp,label,pos,a1,a2, " ".join(genoLine[dupe[0]].sample(dupe[1]) for dupe in sampleDupes),
+					snp,label,pos,a1,a2, " ".join(genoLine[dupe[2]].sample(dupe[3]) for dupe in sampleDupes)
+				))
 			#if dupes
 		#foreach marker
 	except StopIteration:
@@ -564,20 +1874,44 @@ but if resource limits are strictly enforced you should add ~500MB-1GB extra.
 	logOut.close()
 	if genoDupe:
 		genoDupe.close()
+	if markerOut:
+		markerOut.close()
+	for path in (checkpointPath, checkpointPath+'.index'):
+		if os.path.exists(path):
+			os.remove(path)
+	if streaming and markerDupe:
+		print "  WARNING: %d markers are duplicated in one or more .impute2(.gz) files" % (len(markerDupe),)
+		if args.dupes:
+			with open(args.dupes+'.markers','wb') as dupesFile:
+				for n in sorted(markerDupe):
+					dupesFile.write("%s %s\n" % (" ".join(markerOrder.geno(n)), " ".join(prefixList[i] for i in sorted(markerDupe[n]))))
 	for i in iRange0:
 		if genoSkip[i] > 0:
 			print "  WARNING: input .impute2(.gz) file #%d had %d extra markers skipped during processing" % (i+1,genoSkip[i])
-		n = 0
-		try:
-			while True:
-				genoFile[i].next()
-				n += 1
-		except StopIteration:
-			pass
+		n = streamLeftover[i]
+		if (shardEnd == len(selection)) and not region:
+			if decoders:
+				n += decoders[i].remaining()
+			elif columnWorkers:
+				n += columnLeftover.get(i, 0)
+			else:
+				try:
+					while True:
+						genoFile[i].next()
+						n += 1
+				except StopIteration:
+					pass
+		if decoders:
+			decoders[i].close()
 		genoFile[i].close()
 		infoFile[i].close()
 		if n > 0:
 			print "  WARNING: input .impute2(.gz) file #%d has %d leftover lines" % (i+1,n)
 	#foreach input
-	print "... OK: joined %d markers (%d matched, %d incomplete)" % (len(markerIndex),numMatch,numSkip)
+	if columnWorkers:
+		for worker in columnWorkers:
+			if worker.is_alive():
+				worker.terminate()
+			worker.join()
+	print "... OK: joined %d markers (%d matched, %d incomplete)" % ((shardEnd - shardStart) or numMatch,numMatch,numSkip)
 #__main__
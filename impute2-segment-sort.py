@@ -2,111 +2,10 @@
 
 import argparse
 import collections
-import gzip
 import itertools
 import os
 import sys
-import zlib
-
-
-class zopen(object):
-	
-	def __init__(self, fileName, splitChar="\n", chunkSize=1024*1024):
-		self._filePtr = open(fileName,'rb')
-		self._splitChar = splitChar
-		self._chunkSize = chunkSize
-		self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-		self._text = ""
-		self._lines = list()
-	#__init__()
-	
-	
-	def __del__(self):
-		if self._filePtr:
-			self._filePtr.close()
-			self._filePtr = None
-	#__del__()
-	
-	
-	def __enter__(self):
-		return self
-	#__enter__()
-	
-	
-	def __exit__(self, excType, excVal, excTrace):
-		pass
-	#__exit__()
-	
-	
-	def __iter__(self):
-		return self
-	#__iter__()
-	
-	
-	def __next__(self):
-		# if lines are still cached from the last read, pop one
-		if len(self._lines) > 0:
-			return self._lines.pop()
-		# if there's data left in the source file, read and decompress another chunk
-		if self._dc:
-			data = self._dc.unused_data
-			if data:
-				self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-			elif not self._filePtr:
-				raise Exception("cannot read a closed file")
-			else:
-				data = self._filePtr.read(self._chunkSize)
-			if data:
-				self._text += self._dc.decompress(data)
-				data = None
-			else:
-				self._text += self._dc.flush()
-				self._dc = None
-		# if there's no text left, we're done
-		if not self._text:
-			raise StopIteration
-		# split the text into lines
-		self._lines = self._text.split(self._splitChar)
-		self._text = ""
-		# if there's more than one line, store the last to combine with the next chunk
-		# (but if there's only one line, and more to read, then keep reading until we get a linebreak)
-		if len(self._lines) > 1:
-			self._text = self._lines.pop()
-		elif self._dc:
-			self._text = self._lines.pop()
-			self._chunkSize *= 2
-			return self.__next__()
-		# reverse the remaining lines into a stack and pop one to return
-		self._lines.reverse()
-		return self._lines.pop()
-	#__next__()
-	
-	
-	def next(self):
-		return self.__next__()
-	#next()
-	
-	
-	def seek(self, offset, whence = 0):
-		if not self._filePtr:
-			raise Exception("cannot seek a closed file")
-		if offset != 0:
-			raise Exception("zfile.seek() does not support offsets != 0")
-		self._filePtr.seek(0, whence)
-		self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-		self._text = ""
-		self._lines = list()
-	#seek()
-	
-	
-	def close(self):
-		if self._filePtr:
-			self._filePtr.close()
-			self._filePtr = None
-	#close()
-	
-	
-#zopen
+import zfile
 
 
 if __name__ == "__main__":
@@ -139,15 +38,15 @@ in order, without then sorting them.
 	# open input files
 	print "finding input files ..."
 	if os.path.exists(args.input+'.best_guess_haps_imputation.impute2.gz'):
-		genoFile = zopen(args.input+'.best_guess_haps_imputation.impute2.gz')
+		genoFile = zfile.zopen(args.input+'.best_guess_haps_imputation.impute2.gz')
 	elif os.path.exists(args.input+'.best_guess_haps_imputation.impute2'):
-		genoFile = open(args.input+'.best_guess_haps_imputation.impute2','rU')
+		genoFile = zfile.mopen(args.input+'.best_guess_haps_imputation.impute2')
 	else:
 		exit("ERROR: %s.best_guess_haps_imputation.impute2(.gz) not found" % args.input)
 	if os.path.exists(args.input+'.best_guess_haps_imputation.impute2_info.gz'):
-		infoFile = zopen(args.input+'.best_guess_haps_imputation.impute2_info.gz')
+		infoFile = zfile.zopen(args.input+'.best_guess_haps_imputation.impute2_info.gz')
 	elif os.path.exists(args.input+'.best_guess_haps_imputation.impute2_info'):
-		infoFile = open(args.input+'.best_guess_haps_imputation.impute2_info','rU')
+		infoFile = zfile.mopen(args.input+'.best_guess_haps_imputation.impute2_info')
 	else:
 		exit("ERROR: %s.best_guess_haps_imputation.impute2_info(.gz) not found" % args.input)
 	print "... OK"
@@ -301,14 +200,14 @@ in order, without then sorting them.
 	# initialize buffers
 	sampleOut = open(args.output+'.phased.sample', 'wb')
 	sampleDupe = None
-	genoOut = gzip.open(args.output+'.impute2.gz', 'wb', compresslevel=6)
+	genoOut = zfile.zwriter(args.output+'.impute2.gz', compresslevel=6)
 	genoDupe = None
 	genoCols = [ None for i in iRange0 ]
 	genoUniq = [ list() for i in iRange0 ]
 	genoLine = [ None for i in iRange0 ]
 	genoMarker = [ None for i in iRange0 ]
 	genoSkip = [ 0 for i in iRange0 ]
-	infoOut = gzip.open(args.output+'.impute2_info.gz', 'wb', compresslevel=6)
+	infoOut = zfile.zwriter(args.output+'.impute2_info.gz', compresslevel=6)
 	infoOut.write("snp_id rs_id position exp_freq_a1 info certainty type info_type0 concord_type0 r2_type0\n")
 	infoLine = [ None for i in iRange0 ]
 	logOut = open(args.output+'.log', 'wb')
@@ -359,7 +258,7 @@ in order, without then sorting them.
 						sampleDupe.write("%s\n" % sampleHeader1)
 						sampleDupe.write("%s\n" % sampleHeader2)
 					if not genoDupe:
-						genoDupe = open(args.dupes+'.impute2.gz', 'wb')
+						genoDupe = zfile.zwriter(args.dupes+'.impute2.gz', compresslevel=6)
 					sampleDupe.write("(%d/%d)%s\n" % (sampleFirst[sampleID][0],i,(" ".join(sample))))
 			else:
 				sampleFirst[sampleID] = (i,s)
@@ -1,114 +1,190 @@
 #!/usr/bin/env python
 
 import argparse
+import binascii
 import collections
-import gzip
+import functools
 import itertools
+import multiprocessing
+import operator
 import string
-import struct
 import sys
 import tempfile
-import zlib
+import zfile
 
 
-class zopen(object):
+# .bed genotype codes: 0b00 homozygous allele 1, 0b10 heterozygous, 0b11 homozygous allele 2, 0b01 missing;
+# a sample's call is looked up by (p11 >= minprob)<<2 | (p12 >= minprob)<<1 | (p22 >= minprob), so the
+# first of its three probabilities which passes decides it
+CALL_CODES = "".join(chr(0b00 if (k & 4) else (0b10 if (k & 2) else (0b11 if (k & 1) else 0b01))) for k in xrange(256))
+FLIP_CODES = string.maketrans("\x00\x03", "\x03\x00")
+SHIFT_CODES = list( "".join(chr((k << b) & 0xff) for k in xrange(256)) for b in (0,1,2,3,4,5,6,7) )
+UNPACK_CODES = list( "".join(chr((k >> (2*b)) & 0b11) for k in xrange(256)) for b in (0,1,2,3) )
+
+
+def orBytes(parts):
+	# bitwise-or equal-length byte strings together, all at once as big integers
+	if not parts[0]:
+		return ""
+	value = 0
+	for part in parts:
+		value |= int(binascii.hexlify(part), 16)
+	return binascii.unhexlify("%0*x" % (2*len(parts[0]),value))
+#orBytes()
+
+
+class thresholdTable(dict):
+	# memo of whether each probability string reaches the minimum, as "\x01" or "\x00";
+	# imputed probabilities are printed to a few decimals, so a few thousand distinct
+	# strings cover a whole file and most of them are never parsed more than once
 	
-	def __init__(self, fileName, splitChar="\n", chunkSize=1024*1024):
-		self._filePtr = open(fileName,'rb')
-		self._splitChar = splitChar
-		self._chunkSize = chunkSize
-		self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-		self._text = ""
-		self._lines = list()
+	def __init__(self, minprob):
+		self.minprob = minprob
 	#__init__()
 	
 	
-	def __del__(self):
-		if self._filePtr:
-			self._filePtr.close()
-			self._filePtr = None
-	#__del__()
-	
-	
-	def __enter__(self):
-		return self
-	#__enter__()
-	
-	
-	def __exit__(self, excType, excVal, excTrace):
-		pass
-	#__exit__()
-	
+	def __missing__(self, prob):
+		if len(self) >= 1000000:
+			self.clear()
+		passed = self[prob] = "\x01" if (float(prob) >= self.minprob) else "\x00"
+		return passed
+	#__missing__()
 	
-	def __iter__(self):
-		return self
-	#__iter__()
 	
-	
-	def __next__(self):
-		# if lines are still cached from the last read, pop one
-		if len(self._lines) > 0:
-			return self._lines.pop()
-		# if there's data left in the source file, read and decompress another chunk
-		if self._dc:
-			data = self._dc.unused_data
-			if data:
-				self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-			elif not self._filePtr:
-				raise Exception("cannot read a closed file")
-			else:
-				data = self._filePtr.read(self._chunkSize)
-			if data:
-				self._text += self._dc.decompress(data)
-				data = None
-			else:
-				self._text += self._dc.flush()
-				self._dc = None
-		# if there's no text left, we're done
-		if not self._text:
-			raise StopIteration
-		# split the text into lines
-		self._lines = self._text.split(self._splitChar)
-		self._text = ""
-		# if there's more than one line, store the last to combine with the next chunk
-		# (but if there's only one line, and more to read, then keep reading until we get a linebreak)
-		if len(self._lines) > 1:
-			self._text = self._lines.pop()
-		elif self._dc:
-			self._text = self._lines.pop()
-			self._chunkSize *= 2
-			return self.__next__()
-		# reverse the remaining lines into a stack and pop one to return
-		self._lines.reverse()
-		return self._lines.pop()
-	#__next__()
-	
-	
-	def next(self):
-		return self.__next__()
-	#next()
+#thresholdTable
+
+
+def callGenotypes(probs, threshold):
+	# return one .bed code per sample (as a byte string) for a marker's probabilities
+	passed = "".join(map(threshold.__getitem__, probs))
+	keys = orBytes([ passed[0::3].translate(SHIFT_CODES[2]), passed[1::3].translate(SHIFT_CODES[1]), passed[2::3] ])
+	return keys.translate(CALL_CODES)
+#callGenotypes()
+
+
+def packCodes(codes):
+	# pack .bed codes four to a byte, the first in the low bits, padding the last byte with 0b00
+	codes += "\x00" * (-len(codes) % 4)
+	return orBytes([ codes[0::4], codes[1::4].translate(SHIFT_CODES[2]), codes[2::4].translate(SHIFT_CODES[4]), codes[3::4].translate(SHIFT_CODES[6]) ])
+#packCodes()
+
+
+_thresholds = dict() # {minprob:thresholdTable}, kept for the life of a worker process
+
+
+def convertRows(job):
+	# call the genotypes of a batch of .impute2 rows, returning for each one its rs_id, alleles, number
+	# of probabilities, whether its alleles are to be flipped and its packed .bed (flipped) and .ped
+	# (unflipped) codes; this runs in a worker process with --threads, so rows are only checked later
+	lines,minprob,numProbs,binary,text = job
+	threshold = _thresholds.get(minprob)
+	if threshold is None:
+		threshold = _thresholds[minprob] = thresholdTable(minprob)
+	rows = list()
+	for line in lines:
+		words = line.split()
+		probs = words[5:5+numProbs]
+		if len(probs) < numProbs:
+			rows.append( (words[1],words[3],words[4],len(probs),False,None,None) )
+			continue
+		# call every sample at once, then count alleles from the calls
+		codes = callGenotypes(probs, threshold)
+		hets = codes.count("\x02")
+		flipped = (2*codes.count("\x00") + hets) > (2*codes.count("\x03") + hets)
+		pedRow = packCodes(codes) if text else None
+		if flipped:
+			codes = codes.translate(FLIP_CODES)
+		rows.append( (words[1],words[3],words[4],len(probs),flipped,(packCodes(codes) if binary else None),pedRow) )
+	#foreach line
+	return rows
+#convertRows()
+
+
+def convertFile(genoFile, pool, depth, minprob, numProbs, binary, text, batchBytes=4*1024*1024):
+	# yield convertRows() results for every row of a genotype file, in order; with a worker pool,
+	# up to depth batches of rows are converted in parallel at a time
+	batchSize = max(1, min(1024, batchBytes // (6*numProbs + 64)))
+	if not pool:
+		lines = genoFile.next_batch(batchSize)
+		while lines:
+			for row in convertRows( (lines,minprob,numProbs,binary,text) ):
+				yield row
+			lines = genoFile.next_batch(batchSize)
+		return
+	pending = collections.deque()
+	lines = genoFile.next_batch(batchSize)
+	while lines or pending:
+		if lines and (len(pending) < depth):
+			pending.append(pool.apply_async(convertRows, ((lines,minprob,numProbs,binary,text),)))
+			lines = genoFile.next_batch(batchSize)
+		else:
+			for row in pending.popleft().get():
+				yield row
+	#while batches
+#convertFile()
+
+
+class pedMatrix(object):
+	# on-disk transposer for .ped output: each marker's calls are kept as a packed row of 2-bit
+	# .bed codes, and every block of rows is written out sample-major (one byte column, holding
+	# 4 samples, after another), so that each sample's genotypes can later be gathered with one
+	# short read per block; memory use stays fixed, and the temp file takes 2 bits per genotype
+	
+	def __init__(self, numSamples, tempDir, prefix, blockSize=4096):
+		self._numSamples = numSamples
+		self._rowBytes = (numSamples + 3) // 4
+		self._blockSize = blockSize
+		self._file = tempfile.TemporaryFile(mode='w+b', prefix=prefix, dir=tempDir)
+		self._blocks = list() # (offset,markers)
+		self._rows = list()
+		self._genos = list() # per-marker .ped text for each code, shared between markers with the same alleles
+		self._tables = dict()
+	#__init__()
 	
 	
-	def seek(self, offset, whence = 0):
-		if not self._filePtr:
-			raise Exception("cannot seek a closed file")
-		if offset != 0:
-			raise Exception("zfile.seek() does not support offsets != 0")
-		self._filePtr.seek(0, whence)
-		self._dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
-		self._text = ""
-		self._lines = list()
-	#seek()
+	def add(self, row, a1, a2):
+		# add a marker's packed (unflipped) .bed codes, which will be written out as alleles a1/a2
+		genos = self._tables.get((a1,a2))
+		if not genos:
+			genos = self._tables[(a1,a2)] = ("%s %s" % (a1,a1), "0 0", "%s %s" % (a1,a2), "%s %s" % (a2,a2))
+		self._genos.append(genos)
+		self._rows.append(row)
+		if len(self._rows) >= self._blockSize:
+			self._flush()
+	#add()
+	
+	
+	def _flush(self):
+		if self._rows:
+			data = "".join(self._rows)
+			self._file.seek(0, 2)
+			self._blocks.append( (self._file.tell(),len(self._rows)) )
+			self._file.write("".join(data[b::self._rowBytes] for b in xrange(self._rowBytes)))
+			self._rows = list()
+	#_flush()
+	
+	
+	def rows(self):
+		# yield each sample's .ped genotypes as one line of text, in order
+		self._flush()
+		for b in xrange(self._rowBytes):
+			column = list()
+			for offset,markers in self._blocks:
+				self._file.seek(offset + b*markers)
+				column.append(self._file.read(markers))
+			column = "".join(column)
+			for k in xrange(min(4, self._numSamples - 4*b)):
+				yield " ".join(map(operator.getitem, self._genos, bytearray(column.translate(UNPACK_CODES[k]))))
+		#foreach byte column
+	#rows()
 	
 	
 	def close(self):
-		if self._filePtr:
-			self._filePtr.close()
-			self._filePtr = None
+		self._file.close()
 	#close()
 	
 	
-#zopen
+#pedMatrix
 
 
 if __name__ == "__main__":
@@ -122,6 +198,11 @@ if __name__ == "__main__":
 		description=versDesc,
 		epilog="""
 example: %(prog)s -s my.sample -i my.impute2_info.gz -g my.impute2.gz -m 0.9 -p output -b -t -d $TMPDIR
+
+With --threads N, the genotype file(s) are still read in order by the main
+process, but batches of markers are handed out to N worker processes to be
+called and packed, and their results are written back in order, so the outputs
+are the same as with a single process.
 """
 	)
 	parser.add_argument('-s', '--sample', type=str, metavar='file', required=True,
@@ -151,11 +232,34 @@ example: %(prog)s -s my.sample -i my.impute2_info.gz -g my.impute2.gz -m 0.9 -p
 	parser.add_argument('-d', '--tempdir', type=str, metavar='directory', default='.',
 		help="directory to write temporary files while transposing data for plain-text output (default: current directory)"
 	)
+	parser.add_argument('--threads', type=int, metavar='number', default=1,
+		help="number of worker processes among which to split the markers for genotype calling (default: 1)"
+	)
+	parser.add_argument('--cache', type=str, metavar='directory',
+		help="directory on local scratch space in which to keep decompressed copies of input files for re-use by later passes and runs (default: none)"
+	)
+	parser.add_argument('--cache-size', type=float, metavar='gigabytes', default=64,
+		help="maximum size of the input cache, beyond which the least recently used copies are removed (default: 64)"
+	)
+	parser.add_argument('--readahead', type=float, metavar='megabytes', default=0,
+		help="read compressed input files in aligned blocks of this size from a helper thread, for high-latency shared filesystems (default: 0, off)"
+	)
 	parser.add_argument('--version', action='version', version=versDesc)
 	
 	# parse arguments
 	args = parser.parse_args()
 	
+	# start the genotype calling workers, if any, before any input reader threads exist to be forked
+	pool = multiprocessing.Pool(args.threads) if (args.threads > 1) else None
+	
+	# route input files through the local cache, if any
+	zopen,mopen = zfile.zopen,zfile.mopen
+	if args.cache:
+		cache = zfile.zcache(args.cache, int(args.cache_size * 1024*1024*1024))
+		zopen,mopen = cache.zopen,cache.mopen
+	if args.readahead:
+		zopen = functools.partial(zopen, readahead=int(args.readahead * 1024*1024))
+	
 	# store some oft-used arguments to save dictionary lookups
 	args_chromosome = args.chromosome
 	args_minprob = args.minprob
@@ -170,7 +274,7 @@ example: %(prog)s -s my.sample -i my.impute2_info.gz -g my.impute2.gz -m 0.9 -p
 	# read sample file
 	print "reading sample file '%s' ..." % args.sample
 	samples = list()
-	with open(args.sample,'rU') as sampleFile:
+	with mopen(args.sample) as sampleFile:
 		header = sampleFile.next()
 		if not header.startswith("ID_1 ID_2 missing father mother sex plink_pheno"):
 			print "ERROR: unrecognized file header: %s" % header
@@ -193,46 +297,27 @@ example: %(prog)s -s my.sample -i my.impute2_info.gz -g my.impute2.gz -m 0.9 -p
 	for infoPath in args.info:
 		print "reading genotype info file '%s' ..." % infoPath
 		with zopen(infoPath) as infoFile:
-			for line in infoFile:
-				if line.startswith("#"):
-					continue
-				if line.startswith("snp_id rs_id position exp_freq_a1 info certainty type"):
-					continue
-				snpid,rsid,pos,freq,info,certainty,imptype = line.split(None,7)[:7]
-				markerIndex[rsid].add( len(markers) )
-				markers.append( [rsid,pos,freq,imptype] )
-			#foreach line in infoFile
+			lines = infoFile.next_batch(4096)
+			while lines:
+				for line in lines:
+					if line.startswith("#"):
+						continue
+					if line.startswith("snp_id rs_id position exp_freq_a1 info certainty type"):
+						continue
+					snpid,rsid,pos,freq,info,certainty,imptype = line.split(None,7)[:7]
+					markerIndex[rsid].add( len(markers) )
+					markers.append( [rsid,pos,freq,imptype] )
+				#foreach line in batch
+				lines = infoFile.next_batch(4096)
+			#while lines in infoFile
 		#with infoFile
 		print "... OK: %d markers (%d duplicate)" % (len(markers),len(markers)-len(markerIndex))
 	#foreach args.info
 	
-	# read genotype file(s) for marker alleles
-	m = 0
-	for genoPath in args.genotype:
-		print "reading genotype file '%s' ..." % genoPath
-		with zopen(genoPath) as genoFile:
-			for line in genoFile:
-				if m >= len(markers):
-					print "ERROR: genotype file contains too many markers"
-					sys.exit(1)
-				snpid,rsid,pos,a1,a2 = line.split(None,5)[:5]
-				if rsid != markers[m][0]:
-					print "ERROR: genotype marker #%d is '%s', expected '%s'" % (m+1,rsid,markers[m][0])
-					sys.exit(1)
-				markers[m].append(a1)
-				markers[m].append(a2)
-				m += 1
-			#foreach line in genoFile
-		#with genoFile
-		print "... OK"
-	#foreach args.genotype
-	if m < len(markers):
-		print "ERROR: genotype file(s) end after marker #%d, expected %d more markers" % (m,len(markers)-m)
-		sys.exit(1)
-	
-	# markers=[ [rsid,pos,freq,type,a1,a2], ... ]
+	# markers=[ [rsid,pos,freq,type], ... ] (a1,a2 are appended during the genotype pass)
 	
 	# choose between duplicate markers
+	markerLabels = list(marker[0] for marker in markers)
 	markerDrop = set()
 	if True:
 		# the original logic was already complicated, and only covered the case of two versions;
@@ -273,7 +358,7 @@ example: %(prog)s -s my.sample -i my.impute2_info.gz -g my.impute2.gz -m 0.9 -p
 			#if marker is special or duplicate
 		#foreach marker
 		print "... OK"
-	else: # original dupe handling logic
+	else: # original dupe handling logic (needs a1,a2, which would now have to be read before the genotype pass)
 		print "writing .drop.txt file '%s.drop.txt' ..." % args.prefix
 		strandFlipTrans = string.maketrans('AaCcGgTt','TTGGCCAA')
 		# s.translate(strandFlipTrans) is a shorter equivalent of s.replace('A','T').replace('C','G').replace('G','C').replace('T','A')
@@ -344,8 +429,7 @@ example: %(prog)s -s my.sample -i my.impute2_info.gz -g my.impute2.gz -m 0.9 -p
 	# (0,0,0) -> (0,0)
 	
 	# read genotype file(s)
-	sRange = range(0,len(samples))
-	sWord = range(5,5+3*len(samples),3)
+	numProbs = 3*len(samples)
 	m = 0
 	if args_binary:
 		print "writing .bed file '%s.bed' ..." % args.prefix
@@ -357,134 +441,50 @@ example: %(prog)s -s my.sample -i my.impute2_info.gz -g my.impute2.gz -m 0.9 -p
 			bedFileDrop = open(args.prefix+'.drop.bed','wb')
 			bedFileDrop.write("\x6c\x1b") # binary plink file magic number
 			bedFileDrop.write("\x01") # SNP-major order (row per snp, columns per sample)
-		padding = [0] * (-len(samples) % 4)
-		bytes = range(0,(len(samples)+len(padding))/4)
-		packformat = "%dB"%len(bytes)
 	if args_text:
-		mTemp = 0
-		tempFilesKeep = list()
-		pedOutKeep = list( [] for sample in samples )
+		pedKeep = pedMatrix(len(samples), args.tempdir, '.impute2-to-plink.tmp.')
 		if markerDrop:
-			tempFilesDrop = list()
-			pedOutDrop = list( [] for sample in samples )
+			pedDrop = pedMatrix(len(samples), args.tempdir, '.impute2-to-plink.tmp.drop.')
 	for genoPath in args.genotype:
 		print "reading genotype file '%s' ..." % genoPath
 		with zopen(genoPath) as genoFile:
-			for line in genoFile:
-				words = line.split()
-				a1 = a2 = 0
-				if args.binary:
-					if m in markerDrop:
-						bedFile = bedFileDrop
-					else:
-						bedFile = bedFileKeep
-				if args.text:
-					if m in markerDrop:
-						tempFiles = tempFilesDrop
-						pedOut = pedOutDrop
-					else:
-						tempFiles = tempFilesKeep
-						pedOut = pedOutKeep
-				# some code is duplicated here for performance;
-				# doing the if checks for every sample for every marker is a drag
-				if args_binary and args_text:
-					bedOut = list()
-					geno11 = "%s %s" % (words[3],words[3])
-					geno12 = "%s %s" % (words[3],words[4])
-					geno22 = "%s %s" % (words[4],words[4])
-					geno00 = "0 0"
-					for s,w in enumerate(sWord):
-						if float(words[w]) >= args_minprob:
-							a1 += 2
-							bedOut.append(0b00)
-							pedOut[s].append(geno11)
-						elif float(words[w+1]) >= args_minprob:
-							a1 += 1
-							a2 += 1
-							bedOut.append(0b10)
-							pedOut[s].append(geno12)
-						elif float(words[w+2]) >= args_minprob:
-							a2 += 2
-							bedOut.append(0b11)
-							pedOut[s].append(geno22)
-						else:
-							bedOut.append(0b01)
-							pedOut[s].append(geno00)
-					#foreach sample
-				elif args_binary:
-					bedOut = list()
-					for s,w in enumerate(sWord):
-						if float(words[w]) >= args_minprob:
-							a1 += 2
-							bedOut.append(0b00)
-						elif float(words[w+1]) >= args_minprob:
-							a1 += 1
-							a2 += 1
-							bedOut.append(0b10)
-						elif float(words[w+2]) >= args_minprob:
-							a2 += 2
-							bedOut.append(0b11)
-						else:
-							bedOut.append(0b01)
-					#foreach sample
-				elif args_text:
-					geno11 = "%s %s" % (words[3],words[3])
-					geno12 = "%s %s" % (words[3],words[4])
-					geno22 = "%s %s" % (words[4],words[4])
-					geno00 = "0 0"
-					for s,w in enumerate(sWord):
-						if float(words[w]) >= args_minprob:
-							a1 += 2
-							pedOut[s].append(geno11)
-						elif float(words[w+1]) >= args_minprob:
-							a1 += 1
-							a2 += 1
-							pedOut[s].append(geno12)
-						elif float(words[w+2]) >= args_minprob:
-							a2 += 2
-							pedOut[s].append(geno22)
-						else:
-							pedOut[s].append(geno00)
-					#foreach sample
-				#if binary/text
-				if args_binary:
-					bedOut.extend(padding)
-				if a1 > a2:
+			for rsid,a1,a2,numRead,flipped,bedRow,pedRow in convertFile(genoFile, pool, 2*args.threads, args_minprob, numProbs, args_binary, args_text):
+				if m >= len(markers):
+					print "ERROR: genotype file contains too many markers"
+					sys.exit(1)
+				if rsid != markerLabels[m]:
+					print "ERROR: genotype marker #%d is '%s', expected '%s'" % (m+1,rsid,markerLabels[m])
+					sys.exit(1)
+				markers[m].append(a1)
+				markers[m].append(a2)
+				if numRead < numProbs:
+					print "ERROR: genotype marker #%d has %d probabilities, expected %d" % (m+1,numRead,numProbs)
+					sys.exit(1)
+				if flipped:
 					markers[m][2] = "%g" % (1.0-float(markers[m][2]))
 					markers[m][4],markers[m][5] = markers[m][5],markers[m][4]
-					if args_binary:
-						for s in sRange:
-							if bedOut[s] == 0b00:
-								bedOut[s] = 0b11
-							elif bedOut[s] == 0b11:
-								bedOut[s] = 0b00
 				if args_binary:
-					bedFile.write(struct.pack(packformat, *((bedOut[b*4] | (bedOut[b*4+1] << 2) | (bedOut[b*4+2] << 4) | (bedOut[b*4+3] << 6)) for b in bytes)))
+					if m in markerDrop:
+						bedFileDrop.write(bedRow)
+					else:
+						bedFileKeep.write(bedRow)
 				if args_text:
-					mTemp += 1
-					if mTemp >= 100000:
-						print "  writing temp file(s) #%d with %d markers ..." % (len(tempFilesKeep)+1,mTemp)
-						tempFile = tempfile.TemporaryFile(mode='w+b', prefix='.impute2-to-plink.tmp%d.'%(len(tempFilesKeep)+1), dir=args.tempdir)
-						tempFilesKeep.append(tempFile)
-						for out in pedOutKeep:
-							tempFile.write(" ".join(out))
-							tempFile.write("\n")
-						pedOutKeep = list( [] for sample in samples )
-						if markerDrop:
-							tempFile = tempfile.TemporaryFile(mode='w+b', prefix='.impute2-to-plink.tmp%d.drop.'%(len(tempFilesDrop)+1), dir=args.tempdir)
-							tempFilesDrop.append(tempFile)
-							for out in pedOutDrop:
-								tempFile.write(" ".join(out))
-								tempFile.write("\n")
-							pedOutDrop = list( [] for sample in samples )
-						mTemp = 0
-						print "  ... OK"
-					#if mTemp > x
+					if m in markerDrop:
+						pedDrop.add(pedRow, a1, a2)
+					else:
+						pedKeep.add(pedRow, a1, a2)
 				m += 1
-			#foreach line in genoFile
+			#foreach row in genoFile
 		#with genoFile
 		print "... OK"
 	#foreach args.genotype
+	if m < len(markers):
+		print "ERROR: genotype file(s) end after marker #%d, expected %d more markers" % (m,len(markers)-m)
+		sys.exit(1)
+	markerLabels = None
+	if pool:
+		pool.close()
+		pool.join()
 	if args_binary:
 		bedFileKeep.close()
 		if markerDrop:
@@ -492,53 +492,35 @@ example: %(prog)s -s my.sample -i my.impute2_info.gz -g my.impute2.gz -m 0.9 -p
 	
 	if args_text:
 		print "writing .ped.gz file '%s.ped.gz' ..." % args.prefix
-		for tempFile in tempFilesKeep:
-			tempFile.seek(0)
-		with gzip.GzipFile(filename=args.prefix+'.ped.gz', mode='wb', compresslevel=6) as pedFile:
-			for s,sample in enumerate(samples):
+		with zfile.zwriter(args.prefix+'.ped.gz', compresslevel=6) as pedFile:
+			for sample,genos in itertools.izip(samples, pedKeep.rows()):
 				pedFile.write("%s %s %s %s %s %s" % (sample[0],sample[1],sample[3],sample[4],sample[5],sample[6]))
-				for tempFile in tempFilesKeep:
-					line = tempFile.next().rstrip("\n")
-					if line:
-						pedFile.write(" ")
-						pedFile.write(line)
-				if pedOutKeep[s]:
+				if genos:
 					pedFile.write(" ")
-					pedFile.write(" ".join(pedOutKeep[s]))
+					pedFile.write(genos)
 				pedFile.write("\n")
 			#foreach sample
 		#with pedFile
-		pedOutKeep = None
-		for tempFile in tempFilesKeep:
-			tempFile.close()
+		pedKeep.close()
 		print "... OK"
 		
 		if markerDrop:
 			print "writing .drop.ped.gz file '%s.drop.ped.gz' ..." % args.prefix
-			for tempFile in tempFilesDrop:
-				tempFile.seek(0)
-			with gzip.GzipFile(filename=args.prefix+'.drop.ped.gz', mode='wb', compresslevel=6) as pedFile:
-				for s,sample in enumerate(samples):
+			with zfile.zwriter(args.prefix+'.drop.ped.gz', compresslevel=6) as pedFile:
+				for sample,genos in itertools.izip(samples, pedDrop.rows()):
 					pedFile.write("%s %s %s %s %s %s" % (sample[0],sample[1],sample[3],sample[4],sample[5],sample[6]))
-					for tempFile in tempFilesDrop:
-						line = tempFile.next().rstrip("\n")
-						if line:
-							pedFile.write(" ")
-							pedFile.write(line)
-					if pedOutDrop[s]:
+					if genos:
 						pedFile.write(" ")
-						pedFile.write(" ".join(pedOutDrop[s]))
+						pedFile.write(genos)
 					pedFile.write("\n")
 				#foreach sample
 			#with pedFile
-			pedOutDrop = None
-			for tempFile in tempFilesDrop:
-				tempFile.close()
+			pedDrop.close()
 			print "... OK"
 		#if markerDrop
 		
 		print "writing .map.gz file '%s.map.gz' ..." % args.prefix
-		with gzip.GzipFile(filename=args.prefix+'.map.gz', mode='wb', compresslevel=6) as mapFile:
+		with zfile.zwriter(args.prefix+'.map.gz', compresslevel=6) as mapFile:
 			for m,marker in enumerate(markers):
 				if m not in markerDrop:
 					mapFile.write("%s\t%s\t0\t%s\n" % (args_chromosome,marker[0],marker[1]))
@@ -547,7 +529,7 @@ example: %(prog)s -s my.sample -i my.impute2_info.gz -g my.impute2.gz -m 0.9 -p
 		
 		if markerDrop:
 			print "writing .drop.map.gz file '%s.drop.map.gz' ..." % args.prefix
-			with gzip.GzipFile(filename=args.prefix+'.drop.map.gz', mode='wb', compresslevel=6) as mapFile:
+			with zfile.zwriter(args.prefix+'.drop.map.gz', compresslevel=6) as mapFile:
 				for m,marker in enumerate(markers):
 					if m in markerDrop:
 						mapFile.write("%s\t%s\t0\t%s\n" % (args_chromosome,marker[0],marker[1]))
@@ -0,0 +1,1070 @@
+#!/usr/bin/env python
+
+import atexit
+import bisect
+import collections
+import cPickle
+import ctypes
+import ctypes.util
+import hashlib
+import mmap
+import multiprocessing
+import multiprocessing.pool
+import os
+import Queue
+import shutil
+import struct
+import tempfile
+import threading
+import weakref
+import zlib
+
+
+# empty block that marks the end of a BGZF file
+BGZF_EOF = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+# access pattern hints for posix_fadvise() (Linux values)
+FADV_SEQUENTIAL = 2
+FADV_WILLNEED = 3
+
+_workerPool = None
+_running = weakref.WeakSet() # readers whose helper threads must be stopped before the interpreter shuts down
+_workerLock = threading.Lock()
+_workerPid = os.getpid()
+
+# python2's os module has no posix_fadvise(), so call into libc for it
+_fadvise = getattr(os, 'posix_fadvise', None)
+if not _fadvise:
+	try:
+		_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		_fadvise = getattr(_libc, 'posix_fadvise64', None) or _libc.posix_fadvise
+		_fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+	except (OSError,AttributeError):
+		_fadvise = None
+
+
+def workers():
+	# shared thread pool for block (de)compression; zlib releases the GIL, so
+	# threads are enough to keep every core busy without pickling any data
+	global _workerPool, _workerLock, _workerPid
+	if _workerPid != os.getpid():
+		# a forked child inherits the pool object but none of its threads
+		_workerPool = None
+		_workerLock = threading.Lock()
+		_workerPid = os.getpid()
+	with _workerLock:
+		if not _workerPool:
+			_workerPool = multiprocessing.pool.ThreadPool(multiprocessing.cpu_count())
+	return _workerPool
+#workers()
+
+
+def _stopAll():
+	# helper threads are daemons, so on exit (even by an error) they would otherwise keep running while
+	# the interpreter tears down the modules they use, and die noisily; stop them while it's still safe
+	for running in list(_running):
+		running._stop()
+#_stopAll()
+
+atexit.register(_stopAll)
+
+
+def fadvise(fd, offset, length, advice):
+	# pass an access pattern hint to the kernel, if it will take one; the hints
+	# only affect caching and readahead, so any failure is safely ignored
+	if _fadvise:
+		try:
+			_fadvise(fd, offset, length, advice)
+		except (OSError,ctypes.ArgumentError):
+			pass
+#fadvise()
+
+
+def fingerprint(fileName, samples=16, sampleSize=4096):
+	# identify one version of a file by its size, mtime and a hash of evenly spaced
+	# samples of its content, which is cheap even for huge files but still catches
+	# a file that was rewritten in place with its mtime preserved
+	with open(fileName,'rb') as filePtr:
+		stat = os.fstat(filePtr.fileno())
+		digest = hashlib.md5()
+		step = max(sampleSize, (stat.st_size - sampleSize) // max(1, samples - 1))
+		for offset in xrange(0, max(1, stat.st_size - sampleSize + 1), step):
+			filePtr.seek(offset)
+			digest.update(filePtr.read(sampleSize))
+		filePtr.seek(max(0, stat.st_size - sampleSize))
+		digest.update(filePtr.read(sampleSize))
+	return "%d:%d:%s" % (stat.st_size,int(stat.st_mtime),digest.hexdigest())
+#fingerprint()
+
+
+def bgzfBlockSize(header):
+	# if the header starts a BGZF block (gzip member with a 'BC' extra subfield),
+	# return the total size of the block in bytes, otherwise None
+	if (len(header) < 18) or (header[0:4] != "\x1f\x8b\x08\x04"):
+		return None
+	xlen = struct.unpack("<H", header[10:12])[0]
+	x = 12
+	while x + 4 <= min(12 + xlen, len(header)):
+		slen = struct.unpack("<H", header[x+2:x+4])[0]
+		if (header[x:x+2] == "BC") and (slen == 2) and (x + 6 <= len(header)):
+			return struct.unpack("<H", header[x+4:x+6])[0] + 1
+		x += 4 + slen
+	return None
+#bgzfBlockSize()
+
+
+def _inflateBlocks(data, ends):
+	# worker task: inflate a run of complete BGZF blocks
+	text = list()
+	start = 0
+	for end in ends:
+		text.append(zlib.decompress(data[start:end], zlib.MAX_WBITS | 16))
+		start = end
+	return "".join(text)
+#_inflateBlocks()
+
+
+def _deflateBlocks(data, compresslevel, blockSize):
+	# worker task: compress a run of text into complete BGZF blocks
+	blocks = list()
+	for start in xrange(0, len(data), blockSize):
+		text = data[start:start+blockSize]
+		co = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+		body = co.compress(text) + co.flush()
+		blocks.append("\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00")
+		blocks.append(struct.pack("<H", len(body) + 25))
+		blocks.append(body)
+		blocks.append(struct.pack("<II", zlib.crc32(text) & 0xffffffff, len(text)))
+	return "".join(blocks)
+#_deflateBlocks()
+
+
+class zopen(object):
+	
+	def __init__(self, fileName, splitChar="\n", chunkSize=1024*1024, prefetch=4, threads=None, checkpoint=None, index=None, cache=None, readahead=0):
+		self._thread = None
+		self._halt = None
+		self._chunks = None
+		self._filePtr = None
+		self._filePtr = open(fileName,'rb')
+		if readahead:
+			self._filePtr = reader(self._filePtr, readahead)
+		self._fileName = self.name = self.source = fileName
+		self._cache = cache
+		self._splitChar = splitChar
+		self._splitLen = len(splitChar)
+		self._chunkSize = chunkSize
+		self._prefetch = prefetch
+		self._threads = multiprocessing.cpu_count() if (threads is None) else threads
+		self._interval = checkpoint or ((16*1024*1024) if index else None)
+		self._indexPath = index
+		self._indexed = False
+		self._checkpoints = [(0,0,0,None)] # (compressed offset, text offset, line number, decompressor snapshot)
+		if index and os.path.exists(index):
+			self._loadIndex()
+		self._partial = bytearray()
+		self._lines = list()
+		self._index = 0
+		self._offset = 0
+		self._start(self._checkpoints[0])
+	#__init__()
+	
+	
+	def __del__(self):
+		self.close()
+	#__del__()
+	
+	
+	def __enter__(self):
+		return self
+	#__enter__()
+	
+	
+	def __exit__(self, excType, excVal, excTrace):
+		self.close()
+	#__exit__()
+	
+	
+	def __iter__(self):
+		return self
+	#__iter__()
+	
+	
+	def _loadIndex(self):
+		# read checkpoints from the sidecar index, unless it was built for a different version of the file
+		stat = os.fstat(self._filePtr.fileno())
+		checkpoints = list()
+		with open(self._indexPath,'rb') as indexFile:
+			header = indexFile.readline().split()
+			if header != ["#zopen-index", "1", str(stat.st_size), str(int(stat.st_mtime))]:
+				return
+			for line in indexFile:
+				coffset,uoffset,lineNum = line.split()
+				checkpoints.append( (int(coffset),int(uoffset),int(lineNum),None) )
+		#with indexFile
+		if checkpoints and (checkpoints[0][0:3] == (0,0,0)):
+			self._checkpoints = checkpoints
+			self._indexed = True
+	#_loadIndex()
+	
+	
+	def _saveIndex(self):
+		# only gzip member boundaries can be restarted without the decompressor state,
+		# so those are the checkpoints that go in the sidecar index
+		stat = os.fstat(self._filePtr.fileno())
+		with open(self._indexPath+'.tmp','wb') as indexFile:
+			indexFile.write("#zopen-index 1 %d %d\n" % (stat.st_size,int(stat.st_mtime)))
+			for coffset,uoffset,line,dc in self._checkpoints:
+				if not dc:
+					indexFile.write("%d %d %d\n" % (coffset,uoffset,line))
+		#with indexFile
+		os.rename(self._indexPath+'.tmp', self._indexPath)
+		self._indexed = True
+	#_saveIndex()
+	
+	
+	def _mark(self, coffset, uoffset, line, dc):
+		# record a restart point once we're far enough past the last one
+		if uoffset >= self._checkpoints[-1][1] + self._interval:
+			self._checkpoints.append( (coffset,uoffset,line,(dc.copy() if dc else None)) )
+	#_mark()
+	
+	
+	def _inflate(self, checkpoint):
+		# restart from a checkpoint: BGZF input can be inflated block-parallel,
+		# anything else (including a mid-stream decompressor snapshot) is one stream
+		coffset,uoffset,line,dc = checkpoint
+		self._filePtr.seek(coffset)
+		chunks = None
+		if dc:
+			chunks = self._inflateStream(uoffset, line, dc.copy())
+		elif self._threads > 1:
+			header = self._filePtr.read(64)
+			self._filePtr.seek(coffset)
+			if bgzfBlockSize(header):
+				chunks = self._inflateBGZF(uoffset, line)
+		# a full pass from the start can also fill the local cache, if any
+		tee = self._cache.begin(self._fileName) if (self._cache and (coffset == 0)) else None
+		try:
+			for text in (chunks or self._inflateStream(uoffset, line, None)):
+				if tee:
+					try:
+						tee.write(text)
+					except (IOError,OSError):
+						self._cache.abort(tee)
+						tee = None
+				yield text
+			if tee:
+				self._cache.commit(self._fileName, tee)
+				tee = None
+		finally:
+			if tee:
+				self._cache.abort(tee)
+		if self._indexPath and not self._indexed:
+			self._saveIndex()
+	#_inflate()
+	
+	
+	def _inflateBGZF(self, uoffset, line):
+		# carve the source file into whole BGZF blocks and inflate runs of them on
+		# the worker pool, keeping a bounded number in flight and yielding in order
+		pool = workers()
+		pending = collections.deque()
+		data = ""
+		start = self._filePtr.tell()
+		eof = False
+		while True:
+			while (not eof) and (len(pending) < 2 * self._threads):
+				chunk = self._filePtr.read(self._chunkSize)
+				if not chunk:
+					eof = True
+					break
+				data += chunk
+				chunk = None
+				ends = list()
+				end = 0
+				size = bgzfBlockSize(data[0:64])
+				while size and (end + size <= len(data)):
+					end += size
+					ends.append(end)
+					size = bgzfBlockSize(data[end:end+64])
+				if ends:
+					pending.append( (start,pool.apply_async(_inflateBlocks, (data[0:end], ends))) )
+					data = data[end:]
+					start += end
+				if (len(data) >= 64) and not size:
+					# not a BGZF block, so finish the rest as a plain gzip stream
+					eof = True
+			#while more to read
+			if not pending:
+				break
+			coffset,result = pending.popleft()
+			text = result.get()
+			if self._interval:
+				# every run starts on a block boundary, so any of them can be a checkpoint
+				self._mark(coffset, uoffset, line, None)
+				uoffset += len(text)
+				line += text.count(self._splitChar)
+			if text:
+				yield text
+		#while blocks remain
+		if data:
+			self._filePtr.seek(-len(data), 1)
+			for text in self._inflateStream(uoffset, line, None):
+				yield text
+	#_inflateBGZF()
+	
+	
+	def _inflateStream(self, uoffset, line, dc):
+		# read and decompress the source file one chunk at a time, restarting the
+		# decompressor at each gzip member boundary
+		if not dc:
+			dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
+		while True:
+			data = dc.unused_data
+			if data:
+				# a new gzip member starts here, which is a clean restart point
+				if self._interval:
+					self._mark(self._filePtr.tell() - len(data), uoffset, line, None)
+				dc = zlib.decompressobj(zlib.MAX_WBITS | 32) # autodetect gzip or zlib header
+			else:
+				data = self._filePtr.read(self._chunkSize)
+			if not data:
+				text = dc.flush()
+				if text:
+					yield text
+				return
+			text = dc.decompress(data)
+			data = None
+			if self._interval:
+				# all input so far has been consumed, so a copy of the decompressor can resume from here
+				uoffset += len(text)
+				line += text.count(self._splitChar)
+				if not dc.unused_data:
+					self._mark(self._filePtr.tell(), uoffset, line, dc)
+			if text:
+				yield text
+		#while data remains
+	#_inflateStream()
+	
+	
+	def _produce(self, queue, halt, checkpoint):
+		# background thread: run the decompressor ahead of the consumer, handing off
+		# decoded chunks through a bounded queue (zlib releases the GIL while inflating)
+		def put(item, Full=Queue.Full):
+			while not halt.is_set():
+				try:
+					queue.put(item, True, 0.1)
+					return True
+				except Full:
+					pass
+			return False
+		#put()
+		chunks = self._inflate(checkpoint)
+		try:
+			for text in chunks:
+				if not put(text):
+					return
+			put(None)
+		except Exception as e:
+			put(e)
+		finally:
+			chunks.close() # abandon any cache copy now, in this thread
+	#_produce()
+	
+	
+	def _consume(self, queue):
+		while True:
+			text = queue.get()
+			if text is None:
+				return
+			if isinstance(text, Exception):
+				raise text
+			yield text
+	#_consume()
+	
+	
+	def _start(self, checkpoint):
+		if self._prefetch > 0:
+			queue = Queue.Queue(self._prefetch)
+			self._halt = threading.Event()
+			self._thread = threading.Thread(target=self._produce, args=(queue,self._halt,checkpoint))
+			self._thread.daemon = True
+			self._thread.start()
+			_running.add(self)
+			self._chunks = self._consume(queue)
+		else:
+			self._chunks = self._inflate(checkpoint)
+	#_start()
+	
+	
+	def _stop(self):
+		if self._thread:
+			self._halt.set()
+			self._thread.join()
+			self._thread = None
+			self._halt = None
+			_running.discard(self)
+		self._chunks = None
+	#_stop()
+	
+	
+	def _restart(self, checkpoint):
+		self._stop()
+		self._partial = bytearray()
+		self._lines = list()
+		self._index = 0
+		self._offset = checkpoint[1]
+		self._start(checkpoint)
+	#_restart()
+	
+	
+	def _discard(self, skip, skipLines):
+		# inflate and drop text between the restart checkpoint and the seek target,
+		# given either as a number of bytes or a number of line breaks
+		while (skip or skipLines) and self._chunks:
+			try:
+				text = self._chunks.next()
+			except StopIteration:
+				self._chunks = None
+				break
+			p = 0
+			if skip:
+				p = min(skip, len(text))
+				skip -= p
+			while skipLines:
+				n = text.find(self._splitChar, p)
+				if n < 0:
+					p = len(text)
+					break
+				p = n + self._splitLen
+				skipLines -= 1
+			self._offset += p
+			self._split(text[p:])
+		#while skipping
+	#_discard()
+	
+	
+	def _split(self, text):
+		# a chunk without a linebreak just extends the partial line; otherwise the
+		# partial line is completed and the chunk is split into whole lines, with its
+		# tail kept as the new partial line (so a long line is assembled in linear time)
+		if text.find(self._splitChar) < 0:
+			self._partial.extend(text)
+			return False
+		if self._partial:
+			self._partial.extend(text)
+			text = str(self._partial)
+		self._lines = text.split(self._splitChar)
+		self._index = 0
+		self._partial = bytearray(self._lines.pop())
+		return True
+	#_split()
+	
+	
+	def _fill(self):
+		# fetch decompressed chunks until at least one complete line is buffered
+		while self._chunks:
+			try:
+				text = self._chunks.next()
+			except StopIteration:
+				self._chunks = None
+				break
+			if self._split(text):
+				return True
+		#while more chunks
+		if not self._filePtr:
+			raise Exception("cannot read a closed file")
+		# at the end of the file, any partial line is the last line
+		if self._partial:
+			self._lines = [str(self._partial)]
+			self._index = 0
+			self._partial = bytearray()
+			return True
+		return False
+	#_fill()
+	
+	
+	def __next__(self):
+		if (self._index >= len(self._lines)) and not self._fill():
+			raise StopIteration
+		line = self._lines[self._index]
+		self._index += 1
+		self._offset += len(line) + self._splitLen
+		return line
+	#__next__()
+	
+	
+	def next(self):
+		return self.__next__()
+	#next()
+	
+	
+	def next_batch(self, n):
+		# return a list of up to n complete lines, or an empty list at the end of the file
+		batch = list()
+		while len(batch) < n:
+			if (self._index >= len(self._lines)) and not self._fill():
+				break
+			lines = self._lines[self._index:(self._index + n - len(batch))]
+			self._index += len(lines)
+			batch.extend(lines)
+		self._offset += sum(map(len, batch)) + self._splitLen * len(batch)
+		return batch
+	#next_batch()
+	
+	
+	def tell(self):
+		# uncompressed offset of the next line
+		return self._offset
+	#tell()
+	
+	
+	def restartPoint(self):
+		# the last clean checkpoint (a block or member boundary, needing no decompressor
+		# state) at or before the next line, which can be saved and later handed back to seek()
+		for checkpoint in reversed(self._checkpoints):
+			if (checkpoint[1] <= self._offset) and not checkpoint[3]:
+				return checkpoint[0:3]
+		return (0,0,0)
+	#restartPoint()
+	
+	
+	def seek(self, offset, whence = 0, restart=None):
+		# restart from the nearest checkpoint at or before the uncompressed offset (or the
+		# given restartPoint(), if that's nearer), then inflate and discard up to it
+		if not self._filePtr:
+			raise Exception("cannot seek a closed file")
+		if whence == 1:
+			offset += self._offset
+		elif whence != 0:
+			raise Exception("zfile.seek() does not support seeking from the end")
+		c = bisect.bisect_right([checkpoint[1] for checkpoint in self._checkpoints], offset) - 1
+		checkpoint = self._checkpoints[max(c,0)]
+		if restart and (checkpoint[1] < restart[1] <= offset):
+			checkpoint = tuple(restart[0:3]) + (None,)
+		self._restart(checkpoint)
+		self._discard(offset - self._offset, 0)
+	#seek()
+	
+	
+	def seekline(self, line):
+		# restart from the nearest checkpoint before the start of the line (counting from 0),
+		# then inflate and discard the lines in between
+		if not self._filePtr:
+			raise Exception("cannot seek a closed file")
+		c = bisect.bisect_left([checkpoint[2] for checkpoint in self._checkpoints], line) - 1
+		checkpoint = self._checkpoints[max(c,0)]
+		self._restart(checkpoint)
+		self._discard(0, line - checkpoint[2])
+	#seekline()
+	
+	
+	def close(self):
+		self._stop()
+		if self._filePtr:
+			self._filePtr.close()
+			self._filePtr = None
+	#close()
+	
+	
+#zopen
+
+
+class reader(object):
+	
+	def __init__(self, filePtr, blockSize=32*1024*1024, depth=2):
+		# wrap a file opened for reading so that a helper thread fetches it in large
+		# aligned blocks, with kernel readahead requested for the next few blocks
+		self._filePtr = filePtr
+		self._blockSize = blockSize
+		self._depth = depth
+		self._thread = None
+		self._halt = None
+		self._queue = None
+		self._data = ""
+		self._pos = 0
+		self._offset = self._dataStart = filePtr.tell()
+		self.name = filePtr.name
+		fadvise(filePtr.fileno(), 0, 0, FADV_SEQUENTIAL)
+	#__init__()
+	
+	
+	def _fetch(self, queue, halt, offset):
+		# background thread: read one block at a time, always asking for the
+		# following blocks in advance so that several are in flight at once
+		def put(item, Full=Queue.Full):
+			while not halt.is_set():
+				try:
+					queue.put(item, True, 0.1)
+					return True
+				except Full:
+					pass
+			return False
+		#put()
+		try:
+			fd = self._filePtr.fileno()
+			self._filePtr.seek(offset)
+			end = (offset // self._blockSize + 1) * self._blockSize
+			fadvise(fd, offset, end - offset + self._depth * self._blockSize, FADV_WILLNEED)
+			while True:
+				data = self._filePtr.read(end - offset)
+				if not put(data):
+					return
+				if not data:
+					return
+				offset += len(data)
+				end = offset + self._blockSize
+				fadvise(fd, offset + self._depth * self._blockSize, self._blockSize, FADV_WILLNEED)
+			#while data remains
+		except Exception as e:
+			put(e)
+	#_fetch()
+	
+	
+	def _stop(self):
+		if self._thread:
+			self._halt.set()
+			self._thread.join()
+			self._thread = None
+			self._halt = None
+			self._queue = None
+			_running.discard(self)
+	#_stop()
+	
+	
+	def read(self, size=-1):
+		text = list()
+		while size != 0:
+			if self._pos >= len(self._data):
+				if not self._thread:
+					self._queue = Queue.Queue(self._depth)
+					self._halt = threading.Event()
+					self._thread = threading.Thread(target=self._fetch, args=(self._queue,self._halt,self._offset))
+					self._thread.daemon = True
+					self._thread.start()
+					_running.add(self)
+				data = self._queue.get()
+				if isinstance(data, Exception):
+					raise data
+				if not data:
+					self._queue.put(data) # keep reporting EOF
+					break
+				self._dataStart += len(self._data)
+				self._data = data
+				self._pos = 0
+			n = len(self._data) - self._pos
+			if (size >= 0) and (size < n):
+				n = size
+			text.append(self._data[self._pos:self._pos+n] if ((self._pos > 0) or (n < len(self._data))) else self._data)
+			self._pos += n
+			self._offset += n
+			if size > 0:
+				size -= n
+		#while more to read
+		return "".join(text)
+	#read()
+	
+	
+	def tell(self):
+		return self._offset
+	#tell()
+	
+	
+	def seek(self, offset, whence = 0):
+		if whence == 1:
+			offset += self._offset
+		elif whence == 2:
+			offset += os.fstat(self._filePtr.fileno()).st_size
+		elif whence != 0:
+			raise Exception("invalid whence value: %s" % whence)
+		if self._dataStart <= offset <= self._dataStart + len(self._data):
+			# still inside the current block, so there's no need to restart
+			self._pos = offset - self._dataStart
+		else:
+			self._stop()
+			self._data = ""
+			self._dataStart = offset
+			self._pos = 0
+		self._offset = offset
+	#seek()
+	
+	
+	def fileno(self):
+		return self._filePtr.fileno()
+	#fileno()
+	
+	
+	def close(self):
+		self._stop()
+		self._filePtr.close()
+	#close()
+	
+	
+#reader
+
+
+class zwriter(object):
+	
+	def __init__(self, fileName, compresslevel=6, threads=None, blockSize=0xff00, batchBlocks=16, offset=None):
+		# if an offset is given, an existing file is cut back to that length (which
+		# should be one that tell() returned) and appended to, rather than replaced
+		self._filePtr = None
+		if offset is None:
+			self._filePtr = open(fileName,'wb')
+		else:
+			self._filePtr = open(fileName,'r+b')
+			self._filePtr.truncate(offset)
+			self._filePtr.seek(offset)
+		self._compresslevel = compresslevel
+		self._threads = multiprocessing.cpu_count() if (threads is None) else threads
+		self._blockSize = blockSize
+		self._batchSize = blockSize * batchBlocks
+		self._parts = list()
+		self._size = 0
+		self._pending = collections.deque()
+	#__init__()
+	
+	
+	def __del__(self):
+		self.close()
+	#__del__()
+	
+	
+	def __enter__(self):
+		return self
+	#__enter__()
+	
+	
+	def __exit__(self, excType, excVal, excTrace):
+		self.close()
+	#__exit__()
+	
+	
+	def _submit(self, final):
+		# cut the buffered text into whole blocks (plus the remainder, if final) and
+		# compress them on the worker pool, writing finished runs in order
+		data = "".join(self._parts)
+		end = len(data) if final else (len(data) - len(data) % self._blockSize)
+		if end > 0:
+			if self._threads > 1:
+				self._pending.append(workers().apply_async(_deflateBlocks, (data[0:end], self._compresslevel, self._blockSize)))
+				while len(self._pending) > 2 * self._threads:
+					self._filePtr.write(self._pending.popleft().get())
+			else:
+				self._filePtr.write(_deflateBlocks(data[0:end], self._compresslevel, self._blockSize))
+		self._parts = [data[end:]] if (end < len(data)) else list()
+		self._size = len(data) - end
+	#_submit()
+	
+	
+	def write(self, text):
+		if not self._filePtr:
+			raise Exception("cannot write to a closed file")
+		self._parts.append(text)
+		self._size += len(text)
+		if self._size >= self._batchSize:
+			self._submit(False)
+	#write()
+	
+	
+	def flush(self):
+		# end the current block early and write out everything compressed so far
+		if not self._filePtr:
+			raise Exception("cannot flush a closed file")
+		self._submit(True)
+		while self._pending:
+			self._filePtr.write(self._pending.popleft().get())
+		self._filePtr.flush()
+	#flush()
+	
+	
+	def tell(self):
+		# length of the compressed output so far, which ends on a block boundary right after a flush()
+		if not self._filePtr:
+			raise Exception("cannot tell a closed file")
+		return self._filePtr.tell()
+	#tell()
+	
+	
+	def close(self):
+		if self._filePtr:
+			self.flush()
+			self._filePtr.write(BGZF_EOF)
+			self._filePtr.close()
+			self._filePtr = None
+	#close()
+	
+	
+#zwriter
+
+
+class mopen(zopen):
+	
+	def __init__(self, fileName, splitChar="\n", chunkSize=16*1024*1024):
+		self._thread = None
+		self._halt = None
+		self._chunks = None
+		self._map = None
+		self._filePtr = None
+		self._filePtr = open(fileName,'rb')
+		self._fileName = self.name = self.source = fileName
+		self._cache = None
+		self._size = os.fstat(self._filePtr.fileno()).st_size
+		self._map = mmap.mmap(self._filePtr.fileno(), 0, access=mmap.ACCESS_READ) if self._size else ""
+		fadvise(self._filePtr.fileno(), 0, 0, FADV_SEQUENTIAL)
+		self._splitChar = splitChar
+		self._splitLen = len(splitChar)
+		self._chunkSize = chunkSize
+		self._prefetch = 0
+		self._indexPath = None
+		self._interval = None
+		self._checkpoints = [(0,0,0,None)]
+		self._partial = bytearray()
+		self._lines = list()
+		self._index = 0
+		self._offset = 0
+		self._start(self._checkpoints[0])
+	#__init__()
+	
+	
+	def _inflate(self, checkpoint):
+		# hand out large windows of the mapped file, each cut at its last linebreak
+		# so that whole lines can be split out of it at once
+		offset = checkpoint[1]
+		while offset < self._size:
+			end = min(offset + self._chunkSize, self._size)
+			if end < self._size:
+				n = self._map.rfind(self._splitChar, offset, end)
+				if n >= offset:
+					end = n + self._splitLen
+				fadvise(self._filePtr.fileno(), end, self._chunkSize, FADV_WILLNEED)
+			yield self._map[offset:end]
+			offset = end
+		#while more to map
+	#_inflate()
+	
+	
+	def seek(self, offset, whence = 0, restart=None):
+		if not self._filePtr:
+			raise Exception("cannot seek a closed file")
+		if whence == 1:
+			offset += self._offset
+		elif whence == 2:
+			offset += self._size
+		self._restart( (offset,offset,0,None) )
+	#seek()
+	
+	
+	def seekline(self, line):
+		# count linebreaks a window at a time, then find the exact one within the last window
+		if not self._filePtr:
+			raise Exception("cannot seek a closed file")
+		offset = 0
+		while (line > 0) and (offset < self._size):
+			end = min(offset + self._chunkSize, self._size)
+			n = self._map[offset:end].count(self._splitChar)
+			if n < line:
+				line -= n
+				offset = end
+				continue
+			while line > 0:
+				offset = self._map.find(self._splitChar, offset) + self._splitLen
+				line -= 1
+		#while more lines to skip
+		self._restart( (offset,offset,0,None) )
+	#seekline()
+	
+	
+	def close(self):
+		self._stop()
+		if self._map:
+			self._map.close()
+			self._map = None
+		if self._filePtr:
+			self._filePtr.close()
+			self._filePtr = None
+	#close()
+	
+	
+#mopen
+
+
+class zcache(object):
+	
+	def __init__(self, cacheDir, maxSize):
+		self._cacheDir = cacheDir
+		self._maxSize = maxSize
+		if not os.path.isdir(cacheDir):
+			os.makedirs(cacheDir)
+	#__init__()
+	
+	
+	def _entry(self, fileName):
+		# cache entries are keyed by the source file's path, size and mtime
+		stat = os.stat(fileName)
+		key = hashlib.sha1("%s\0%d\0%d" % (os.path.realpath(fileName),stat.st_size,int(stat.st_mtime))).hexdigest()[0:16]
+		name = os.path.basename(fileName)
+		if name.endswith('.gz'):
+			name = name[:-3]
+		return os.path.join(self._cacheDir, "%s.%s" % (key,name))
+	#_entry()
+	
+	
+	def _lookup(self, fileName):
+		# a path inside the cache (such as the name of a reader opened from it) is a local copy
+		# already, rather than a source to be copied in again under a key of its own
+		if os.path.dirname(os.path.realpath(fileName)) == os.path.realpath(self._cacheDir):
+			entry = fileName
+		else:
+			entry = self._entry(fileName)
+		try:
+			os.utime(entry, None) # mark as recently used
+		except OSError:
+			return None
+		return entry
+	#_lookup()
+	
+	
+	def _evict(self, size):
+		# drop the least recently used entries until there's room for a new one of this size
+		entries = list()
+		for name in os.listdir(self._cacheDir):
+			if not name.endswith('.tmp'):
+				try:
+					stat = os.stat(os.path.join(self._cacheDir, name))
+					entries.append( (stat.st_mtime,stat.st_size,name) )
+				except OSError:
+					pass
+		#foreach entry
+		entries.sort()
+		total = sum(entry[1] for entry in entries)
+		for mtime,entrySize,name in entries:
+			if total + size <= self._maxSize:
+				break
+			try:
+				os.remove(os.path.join(self._cacheDir, name))
+				total -= entrySize
+			except OSError:
+				pass
+		#foreach entry
+		return (total + size <= self._maxSize)
+	#_evict()
+	
+	
+	def begin(self, fileName):
+		# each copy in progress needs a name of its own, since two readers (even in one process)
+		# may both be copying the same source, and one's abort must not remove the other's file
+		fd,path = tempfile.mkstemp(prefix=os.path.basename(self._entry(fileName))+'.', suffix='.tmp', dir=self._cacheDir)
+		os.close(fd)
+		return open(path, 'wb')
+	#begin()
+	
+	
+	def commit(self, fileName, tee):
+		tee.close()
+		if self._evict(os.path.getsize(tee.name)):
+			os.rename(tee.name, self._entry(fileName))
+		else:
+			os.remove(tee.name)
+	#commit()
+	
+	
+	def abort(self, tee):
+		tee.close()
+		try:
+			os.remove(tee.name)
+		except OSError:
+			pass
+	#abort()
+	
+	
+	def zopen(self, fileName, splitChar="\n", **kwargs):
+		# read the local decompressed copy if there is one, otherwise decompress
+		# the source as usual and keep a copy if the whole file is read
+		entry = self._lookup(fileName)
+		if entry:
+			try:
+				reader = mopen(entry, splitChar=splitChar)
+				reader.source = fileName
+				return reader
+			except (IOError,OSError):
+				pass # evicted by another process since the lookup
+		return zopen(fileName, splitChar=splitChar, cache=self, **kwargs)
+	#zopen()
+	
+	
+	def mopen(self, fileName, **kwargs):
+		# copy an uncompressed source into the cache up front, then map the local copy
+		entry = self._lookup(fileName)
+		if not entry:
+			tee = self.begin(fileName)
+			try:
+				with open(fileName,'rb') as filePtr:
+					shutil.copyfileobj(filePtr, tee, 16*1024*1024)
+				self.commit(fileName, tee)
+			except (IOError,OSError):
+				self.abort(tee)
+			entry = self._lookup(fileName)
+		try:
+			reader = mopen(entry or fileName, **kwargs)
+		except (IOError,OSError):
+			if not entry:
+				raise
+			reader = mopen(fileName, **kwargs) # evicted by another process since the lookup
+		reader.source = fileName
+		return reader
+	#mopen()
+	
+	
+#zcache
+
+
+class zindex(object):
+	# persistent store of whatever a tool derives from scanning a set of input files
+	# (marker tables, offsets, ...); each entry records the fingerprints of the files
+	# it was built from, and is ignored once any of them changes
+	
+	def __init__(self, indexDir):
+		self._indexDir = indexDir
+		if not os.path.isdir(indexDir):
+			os.makedirs(indexDir)
+	#__init__()
+	
+	
+	def _entry(self, fileNames, kind):
+		key = hashlib.sha1("\0".join([kind] + list(os.path.realpath(fileName) for fileName in fileNames))).hexdigest()[0:16]
+		return os.path.join(self._indexDir, "%s.%s.%s" % (key,os.path.basename(fileNames[0]),kind))
+	#_entry()
+	
+	
+	def load(self, fileNames, prints, kind):
+		# return the stored data, or None if there is none for these versions of the files
+		try:
+			with open(self._entry(fileNames, kind),'rb') as indexFile:
+				if indexFile.readline().split() != (["#zindex", "1"] + list(prints)):
+					return None
+				return cPickle.load(indexFile)
+		except (IOError,OSError,EOFError,AttributeError,ImportError,ValueError,TypeError,cPickle.UnpicklingError):
+			return None
+	#load()
+	
+	
+	def save(self, fileNames, prints, kind, data):
+		# store the data derived from these versions of the files; the fingerprints
+		# should be taken before the files are read, in case they change meanwhile
+		entry = self._entry(fileNames, kind)
+		try:
+			with open("%s.%d.tmp" % (entry,os.getpid()),'wb') as indexFile:
+				indexFile.write("#zindex 1 %s\n" % (" ".join(prints),))
+				cPickle.dump(data, indexFile, cPickle.HIGHEST_PROTOCOL)
+			os.rename(indexFile.name, entry)
+		except (IOError,OSError):
+			try:
+				os.remove(indexFile.name)
+			except (OSError,NameError):
+				pass
+	#save()
+	
+	
+#zindex